@@ -1,42 +1,67 @@
-from flask import Flask, render_template, request, send_file, redirect, url_for, jsonify, flash
+from flask import Flask, render_template, request, send_file, send_from_directory, redirect, url_for, jsonify, flash, abort
+from flask.json.provider import DefaultJSONProvider
+from werkzeug.exceptions import NotFound
 import os
 import re
 import base64
 import json
-import traceback
+import orjson
+import logging
 import gc
 import io
+import hashlib
+import httpx
 import pypdf
 from PIL import Image
-from docxtpl import DocxTemplate
-from openai import OpenAI
+import jinja2
 from dotenv import load_dotenv
 import time
-
-# Optional imports for PDF to image conversion
-try:
-    from pdf2image import convert_from_path
-    PDF2IMAGE_AVAILABLE = True
-except ImportError:
-    convert_from_path = None  # type: ignore
-    PDF2IMAGE_AVAILABLE = False
-
-# Enable PyMuPDF - Safe due to sequential processing
-try:
-    import fitz  # PyMuPDF
-    FITZ_AVAILABLE = True
-except ImportError:
-    fitz = None  # type: ignore
-    FITZ_AVAILABLE = False
+import shutil
+import uuid
+import threading
+from collections import OrderedDict
+from datetime import datetime, timezone
+from functools import wraps
+from contextlib import nullcontext
+from operator import itemgetter
+from concurrent.futures import ThreadPoolExecutor
+
+from prompts import (CONTRACT_PROMPT, IDENTITY_PROMPT, ADDRESS_PROMPT, MISTRAL_PROMPT, PARTNER_PROMPT,
+                     CONTRACT_RESPONSE_FORMAT, PDF_TEXT_LIMIT)
+from pdf_text import strip_page_furniture, join_page_texts
 
 load_dotenv()
 
+# Logging: messages use %-style arguments so DEBUG output costs nothing unless
+# LOG_LEVEL=DEBUG is set.
+logging.basicConfig(level=os.getenv('LOG_LEVEL', 'INFO').upper(),
+                    format='%(asctime)s - %(levelname)s - %(message)s')
+logger = logging.getLogger(__name__)
+
 # Get the directory where app.py is located
 BASE_DIR = os.path.dirname(os.path.abspath(__file__))
 
+class ORJSONProvider(DefaultJSONProvider):
+    """jsonify()/request.get_json() backed by orjson instead of the stdlib."""
+
+    def dumps(self, obj, **kwargs):
+        return orjson.dumps(obj, default=self.default, option=orjson.OPT_NON_STR_KEYS).decode()
+
+    def loads(self, s, **kwargs):
+        return orjson.loads(s)
+
+    def response(self, *args, **kwargs):
+        # Hand orjson's bytes straight to the response, no str round-trip
+        obj = self._prepare_response_obj(args, kwargs)
+        return self._app.response_class(
+            orjson.dumps(obj, default=self.default, option=orjson.OPT_NON_STR_KEYS),
+            mimetype=self.mimetype
+        )
+
 app = Flask(__name__, 
             template_folder=os.path.join(BASE_DIR, 'templates'),
             static_folder=os.path.join(BASE_DIR, 'static'))
+app.json = ORJSONProvider(app)
 
 # Use /tmp for serverless environments (Vercel), .tmp for local
 if os.environ.get('VERCEL'):
@@ -45,24 +70,111 @@ else:
     app.config['UPLOAD_FOLDER'] = os.path.join(BASE_DIR, '.tmp')
     
 app.config['SECRET_KEY'] = os.environ.get('SECRET_KEY', 'dev_key_very_secret')
+# Upper bounds for Werkzeug's body/form parsing on every route (/generate
+# tightens the body limit further, see guard_generate_form). The body limit
+# covers /process, which accepts several PDFs and photos in one request.
+app.config['MAX_CONTENT_LENGTH'] = 32 * 1024 * 1024
+app.config['MAX_FORM_MEMORY_SIZE'] = 256 * 1024  # per non-file field
+app.config['MAX_FORM_PARTS'] = 500
 
 # Ensure tmp folder exists
 os.makedirs(app.config['UPLOAD_FOLDER'], exist_ok=True)
 
-# OpenAI Client
+def pick_scratch_folder():
+    """
+    Uploads only live for the duration of one extraction, so keep them in RAM
+    (/dev/shm) when it is available and roomy enough; otherwise UPLOAD_FOLDER.
+    UPLOAD_SCRATCH_DIR overrides the choice.
+    """
+    override = os.environ.get('UPLOAD_SCRATCH_DIR')
+    if override:
+        return override
+    if not os.environ.get('VERCEL') and os.path.isdir('/dev/shm') and os.access('/dev/shm', os.W_OK):
+        try:
+            stats = os.statvfs('/dev/shm')
+            # Container defaults (64 MB) are too small for parallel PDF uploads
+            if stats.f_bavail * stats.f_frsize >= 512 * 1024 * 1024:
+                return '/dev/shm/contrato-social'
+        except OSError:
+            pass
+    return app.config['UPLOAD_FOLDER']
+
+app.config['SCRATCH_FOLDER'] = pick_scratch_folder()
+os.makedirs(app.config['SCRATCH_FOLDER'], exist_ok=True)
+
+def build_http_client():
+    """
+    Long-lived HTTP client for the AI APIs: keeps TLS connections alive across
+    requests and multiplexes concurrent extractions over HTTP/2.
+    """
+    return httpx.Client(
+        http2=True,
+        limits=httpx.Limits(max_connections=64, max_keepalive_connections=32),
+        timeout=httpx.Timeout(60.0, connect=5.0)
+    )
+
+_UNSET = object()
+
+def lazy(factory):
+    """
+    Run `factory` once, on first use, and cache its result (None included).
+    Keeps heavy optional SDKs out of the cold-start import path.
+    """
+    value = _UNSET
+    lock = threading.Lock()
+
+    @wraps(factory)
+    def getter():
+        nonlocal value
+        if value is _UNSET:
+            with lock:
+                if value is _UNSET:
+                    value = factory()
+        return value
+    return getter
+
+# Optional imports for PDF to image conversion, loaded on the first PDF render
+@lazy
+def get_fitz():
+    try:
+        import fitz  # PyMuPDF
+        return fitz
+    except ImportError:
+        return None
+
+@lazy
+def get_convert_from_path():
+    try:
+        from pdf2image import convert_from_path
+        return convert_from_path
+    except ImportError:
+        return None
+
+# OpenAI Client (SDK imported on first use; check openai_key for availability)
 openai_key = os.getenv("OPENAI_API_KEY")
-openai_client = OpenAI(api_key=openai_key) if openai_key else None
 
-# Mistral AI Client
+@lazy
+def get_openai_client():
+    if not openai_key:
+        return None
+    from openai import OpenAI
+    return OpenAI(api_key=openai_key, http_client=build_http_client())
+
+# Mistral AI Client (SDK imported on first use)
 mistral_key = os.getenv("MISTRAL_API_KEY")
-mistral_client = None
-if mistral_key:
+
+@lazy
+def get_mistral_client():
+    if not mistral_key:
+        return None
     try:
         from mistralai import Mistral
-        mistral_client = Mistral(api_key=mistral_key)
-        print("[INFO] Mistral AI client initialized")
+        client = Mistral(api_key=mistral_key, client=build_http_client())
+        logger.info("Mistral AI client initialized")
+        return client
     except Exception as e:
-        print(f"[WARN] Could not initialize Mistral: {e}")
+        logger.warning("Could not initialize Mistral: %s", e)
+        return None
 
 # Supabase Client
 supabase_client = None
@@ -70,75 +182,333 @@ supabase_url = os.getenv("SUPABASE_URL")
 supabase_key = os.getenv("SUPABASE_KEY")
 if supabase_url and supabase_key:
     try:
-        from supabase import create_client, Client
-        supabase_client: Client = create_client(supabase_url, supabase_key)
-        print("[INFO] Supabase client initialized")
+        from supabase import create_client, Client, ClientOptions
+        from postgrest.types import CountMethod, ReturnMethod
+        # One module-level client shared by every request, backed by a pooled
+        # keep-alive connection so PostgREST calls skip the TLS handshake.
+        supabase_http_client = httpx.Client(
+            limits=httpx.Limits(max_connections=20, max_keepalive_connections=10, keepalive_expiry=30.0),
+            timeout=httpx.Timeout(10.0, connect=5.0)
+        )
+        try:
+            supabase_options = ClientOptions(httpx_client=supabase_http_client, postgrest_client_timeout=10)
+        except TypeError:
+            # Older supabase-py releases don't accept a custom httpx client
+            supabase_http_client.close()
+            supabase_options = ClientOptions(postgrest_client_timeout=10)
+        supabase_client: Client = create_client(supabase_url, supabase_key, options=supabase_options)
+        logger.info("Supabase client initialized")
+    except Exception as e:
+        logger.warning("Could not initialize Supabase: %s", e)
+
+SUPABASE_RETRY_ATTEMPTS = 3
+SUPABASE_RETRY_ERRORS = (httpx.ConnectError, httpx.RemoteProtocolError)
+
+def execute_with_reconnect(query):
+    """
+    Execute a Supabase query, retrying with backoff when a pooled connection
+    was dropped by the server (idle keep-alive closed, HTTP/2 GOAWAY, ...).
+    """
+    for attempt in range(SUPABASE_RETRY_ATTEMPTS):
+        try:
+            return query.execute()
+        except SUPABASE_RETRY_ERRORS as e:
+            if attempt == SUPABASE_RETRY_ATTEMPTS - 1:
+                raise
+            logger.warning("Supabase connection error (%s), retrying...", type(e).__name__)
+            time.sleep(0.2 * (2 ** attempt))
+
+# Supabase writes that the response doesn't depend on run here, concurrently
+# with the rest of the request. Serverless platforms freeze the process once
+# the response is sent, so there callers wait for the write before returning.
+BACKGROUND_WRITES_DETACHED = not os.environ.get('VERCEL')
+BACKGROUND_WRITES = ThreadPoolExecutor(max_workers=4, thread_name_prefix='supabase-write')
+
+def run_in_background(func, *args):
+    return BACKGROUND_WRITES.submit(func, *args)
+
+def finish_background_write(future):
+    if future is not None and not BACKGROUND_WRITES_DETACHED:
+        future.result()
+
+# Each prompt's fingerprint (prompts.py) is part of its extraction cache
+# namespace, so editing a prompt automatically invalidates old results.
+def prompt_version(name, prompt):
+    """Cache namespace for a prompt: its name plus a short hash of its text."""
+    return f"{name}_{hashlib.sha256(prompt.encode('utf-8')).hexdigest()[:8]}"
+
+def vision_messages(prompt, *image_parts):
+    """
+    Static instructions go first as the system message and the per-request
+    images last, so OpenAI's prompt cache can reuse the shared prefix.
+    """
+    return [
+        {"role": "system", "content": prompt},
+        {"role": "user", "content": list(image_parts)}
+    ]
+
+def image_part(image_bytes, mime_type, detail):
+    """Vision content part for raw image bytes; base64 happens only here, once."""
+    data_url = f"data:{mime_type};base64,{base64.b64encode(image_bytes).decode('ascii')}"
+    return {"type": "image_url", "image_url": {"url": data_url, "detail": detail}}
+
+# JSON mode for the Vision and Mistral calls, shared instead of rebuilt per request
+JSON_OBJECT_FORMAT = {"type": "json_object"}
+
+def prompt_cache_options(cache_key):
+    """Route requests sharing a prompt prefix to the same prompt-cache shard."""
+    return {"extra_body": {"prompt_cache_key": cache_key}}
+
+IDENTITY_CACHE_KEY = prompt_version('identity', IDENTITY_PROMPT)
+ADDRESS_CACHE_KEY = prompt_version('address', ADDRESS_PROMPT)
+PARTNER_CACHE_KEY = prompt_version('partner', PARTNER_PROMPT)
+CONTRACT_CACHE_KEY = prompt_version('contract', CONTRACT_PROMPT)
+
+# Extraction results hold CPFs, RGs and addresses, so they are only cached in
+# memory (see cached_extraction); drop any an older version left on disk.
+shutil.rmtree(os.path.join(app.config['UPLOAD_FOLDER'], 'extract_cache'), ignore_errors=True)
+
+
+# SHA-256 of uploads, computed while streaming them to disk (see save_upload)
+UPLOAD_CHUNK_SIZE = 1024 * 1024
+_upload_digests = {}
+
+def save_upload(file, filepath):
+    """
+    Stream an uploaded file to disk in chunks, hashing it in the same pass.
+    The digest is remembered so the extraction cache never re-reads the file.
+    """
+    digest = hashlib.sha256()
+    # Buffered writer: it retries short writes, and chunks larger than its
+    # buffer go straight to the file without an extra copy
+    with open(filepath, 'wb') as out:
+        while True:
+            chunk = file.stream.read(UPLOAD_CHUNK_SIZE)
+            if not chunk:
+                break
+            digest.update(chunk)
+            out.write(chunk)
+    _upload_digests[filepath] = digest.hexdigest()
+    return _upload_digests[filepath]
+
+def file_digest(filepath):
+    """SHA-256 hex digest of a file, reusing the one computed by save_upload."""
+    known = _upload_digests.get(filepath)
+    if known:
+        return known
+    with open(filepath, 'rb') as f:
+        if hasattr(hashlib, 'file_digest'):  # Python 3.11+: reuses one buffer
+            return hashlib.file_digest(f, 'sha256').hexdigest()
+        digest = hashlib.sha256()
+        while True:
+            chunk = f.read(UPLOAD_CHUNK_SIZE)
+            if not chunk:
+                break
+            digest.update(chunk)
+    return digest.hexdigest()
+
+def normalize_text_for_cache(text):
+    """Collapse whitespace and drop control chars so near-identical texts share a key."""
+    return ' '.join(''.join(c for c in text if c.isprintable() or c.isspace()).split())
+
+class BytesLRU:
+    """Small thread-safe LRU of bytes values (rendered documents, serialized results)."""
+
+    def __init__(self, max_entries):
+        self.max_entries = max_entries
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            data = self._entries.get(key)
+            if data is not None:
+                self._entries.move_to_end(key)
+            return data
+
+    def put(self, key, data):
+        with self._lock:
+            self._entries[key] = data
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+# Content-addressed cache for AI extraction results (avoids re-calling the LLM
+# when the same document is uploaded again, e.g. on form re-submits). Entries
+# are serialized JSON so each hit hands the caller a fresh dict it can mutate.
+_extraction_memory_cache = BytesLRU(256)
+
+def cached_extraction(provider, model, prompt_version, source='file', text_limit=None):
+    """
+    Cache an extractor's result in memory, keyed by SHA-256 of its input plus
+    (provider, model, prompt_version). `source` tells whether the first
+    argument is a file path ('file'), a tuple of file paths ('files'), raw
+    image bytes ('bytes') or the document text ('text').
+    Text is keyed on what the model actually sees: only the first `text_limit`
+    chars, with whitespace collapsed, so OCR/layout jitter still hits the cache.
+    Empty results are never cached so failures are retried on the next call.
+    """
+    namespace = f"{provider}:{model}:{prompt_version}".encode('utf-8')
+
+    def decorator(func):
+        @wraps(func)
+        def wrapper(data, *args, **kwargs):
+            if not data:
+                return func(data, *args, **kwargs)
+            try:
+                if source == 'file':
+                    content_digest = file_digest(data)
+                elif source == 'files':
+                    content_digest = hashlib.sha256(
+                        ''.join(file_digest(path) for path in data).encode('ascii')
+                    ).hexdigest()
+                elif source == 'bytes':
+                    content_digest = hashlib.sha256(data).hexdigest()
+                else:
+                    text = normalize_text_for_cache(data[:text_limit])
+                    content_digest = hashlib.sha256(text.encode('utf-8')).hexdigest()
+            except OSError:
+                return func(data, *args, **kwargs)
+
+            key = hashlib.sha256(namespace + b'\0' + content_digest.encode('ascii')).hexdigest()
+
+            cached = _extraction_memory_cache.get(key)
+            if cached is not None:
+                logger.debug("Extraction cache hit for %s: %s", func.__name__, key[:12])
+                return orjson.loads(cached)
+
+            result = func(data, *args, **kwargs)
+            if result:
+                _extraction_memory_cache.put(key, orjson.dumps(result))
+            return result
+        return wrapper
+    return decorator
+
+def open_pdf_document(filepath):
+    """
+    Open a PDF with PyMuPDF so text extraction and rendering can share one
+    parse of the file. Returns None if PyMuPDF is missing or cannot open it.
+    """
+    fitz = get_fitz()
+    if fitz is None:
+        return None
+    try:
+        return fitz.open(filepath)
     except Exception as e:
-        print(f"[WARN] Could not initialize Supabase: {e}")
+        logger.warning("PyMuPDF could not open %s: %s", filepath, e)
+        return None
 
+# Text layers by (file digest, max_chars): re-uploading the same PDF (e.g. a
+# retried /process) skips parsing it again. Stored as UTF-8 bytes.
+_pdf_text_cache = BytesLRU(128)
 
-def extract_text_from_pdf(filepath):
+def extract_text_from_pdf(filepath, max_chars=None, doc=None):
+    """
+    Extract the PDF text layer page by page.
+    Stops as soon as `max_chars` have been collected, since callers only send
+    a bounded slice of the text to the AI parsers.
+    `doc` may be the already-open PyMuPDF document for `filepath`.
+    """
+    try:
+        key = f"{file_digest(filepath)}:{max_chars}"
+    except OSError:
+        key = None
+    cached = _pdf_text_cache.get(key) if key else None
+    if cached is not None:
+        logger.debug("PDF text cache hit: %s", filepath)
+        return cached.decode('utf-8')
+    
+    text = read_pdf_text(filepath, max_chars, doc)
+    if text is None:
+        return ""
+    if key:
+        _pdf_text_cache.put(key, text.encode('utf-8'))
+    return text
+
+def read_pdf_text(filepath, max_chars=None, doc=None):
+    """Uncached extract_text_from_pdf; returns None if the PDF can't be read."""
+    # PyMuPDF extracts text in C, far faster than pypdf's pure-Python parser
+    fitz = get_fitz()
+    if doc is not None or fitz is not None:
+        try:
+            with nullcontext(doc) if doc is not None else fitz.open(filepath) as pdf:
+                return join_page_texts(strip_page_furniture(page.get_text("text") for page in pdf), max_chars)
+        except Exception as e:
+            logger.warning("PyMuPDF text extraction failed for %s, trying pypdf: %s", filepath, e)
+    
     try:
         reader = pypdf.PdfReader(filepath)
-        text = ""
-        for page in reader.pages:
-            text += page.extract_text() + "\n"
-        return text
+        # Plain mode: no layout reconstruction, we only need the raw text
+        return join_page_texts(strip_page_furniture(page.extract_text(extraction_mode="plain")
+                                                    for page in reader.pages), max_chars)
     except Exception as e:
-        print(f"Error reading PDF {filepath}: {e}")
-        return ""
+        logger.error("Error reading PDF %s: %s", filepath, e)
+        return None
 
-def extract_data_with_ai(text):
-    if not openai_client or not text:
+# Identity and address documents use the same text parser while the user waits:
+# three attempts (the client retries twice) must fit gunicorn's 120s timeout.
+INTERACTIVE_SERVICE_OPTIONS = {"timeout": 30}
+
+# Company documents are parsed from their text layer and aren't latency
+# critical, so they may run on a cheaper OpenAI service tier (e.g. "flex" on
+# models that support it). Unset keeps the account default.
+COMPANY_SERVICE_TIER = os.getenv('OPENAI_COMPANY_SERVICE_TIER')
+COMPANY_SERVICE_OPTIONS = dict(INTERACTIVE_SERVICE_OPTIONS)
+if COMPANY_SERVICE_TIER:
+    COMPANY_SERVICE_OPTIONS["service_tier"] = COMPANY_SERVICE_TIER
+if COMPANY_SERVICE_TIER == 'flex':
+    # Flex requests can queue for minutes before they start
+    COMPANY_SERVICE_OPTIONS["timeout"] = 900
+
+@cached_extraction('openai', 'gpt-4o', prompt_version('contract', CONTRACT_PROMPT), source='text', text_limit=15000)
+def extract_data_with_ai(text, service_options=INTERACTIVE_SERVICE_OPTIONS):
+    if not openai_key or not text:
         return {}
     
-    prompt = """
-    Extract data from the provided text for a "Contrato Social". 
-    Return a JSON object with keys: 
-    - name (Full Name)
-    - nationality
-    - civil_state
-    - regime (if married)
-    - profession
-    - birth_date
-    - cpf
-    - address (Full address including CEP)
-    
-    If it's a company document, extract:
-    - company_name
-    - company_address
-    - company_object
-    - company_cnae_list
-    - start_date
-    - capital_currency
-    - total_quotas
-    - quota_value
-    - forum_city
-
-    Return minimal valid JSON.
-    """
-    
     try:
-        assert openai_client is not None  # Already checked above
-        response = openai_client.chat.completions.create(
+        response = get_openai_client().chat.completions.create(
             model="gpt-4o",
             messages=[
-                {"role": "system", "content": "You are a legal assistant."},
-                {"role": "user", "content": f"{prompt}\n\nText:\n{text[:15000]}"}
+                {"role": "system", "content": f"You are a legal assistant.\n{CONTRACT_PROMPT}"},
+                {"role": "user", "content": f"Text:\n{text[:15000]}"}
             ],
-            response_format={"type": "json_object"}
+            response_format=CONTRACT_RESPONSE_FORMAT,
+            **service_options,
+            **prompt_cache_options(CONTRACT_CACHE_KEY)
         )
-        return json.loads(response.choices[0].message.content)
-    except json.JSONDecodeError as e:
-        print(f"[ERROR] Invalid JSON from AI: {e}")
+        message = response.choices[0].message
+        if not message.content:
+            logger.warning("AI declined to extract contract data: %s", getattr(message, 'refusal', None))
+            return {}
+        # Keep only fields that were found, so nulls never overwrite data
+        # merged from the other uploaded documents
+        return {k: v for k, v in orjson.loads(message.content).items() if v}
+    except orjson.JSONDecodeError as e:
+        logger.error("Invalid JSON from AI: %s", e)
         return {}
     except Exception as e:
-        print(f"[ERROR] AI Extraction Error: {e}")
+        logger.error("AI Extraction Error: %s", e)
         return {}
 
+# Shared pool for CPU-bound Pillow work (decode/resize/JPEG encode release the GIL)
+IMAGE_POOL_WORKERS = 4
+IMAGE_POOL = ThreadPoolExecutor(max_workers=IMAGE_POOL_WORKERS, thread_name_prefix='pillow')
+
 def compress_image_for_api(filepath, max_size_kb=1024, max_dimension=2500):
-    """Compress and resize image to reduce memory and API payload."""
+    """Compress and resize image to reduce memory and API payload. Returns (bytes, mime_type)."""
     try:
+        # Small JPEGs already fit the budget: send them as-is instead of a
+        # decode + re-encode that would only lose quality (Image.open only reads the header)
+        if (filepath.lower().endswith(('.jpg', '.jpeg'))
+                and os.path.getsize(filepath) < max_size_kb * 1024 * 0.8):
+            with Image.open(filepath) as img:
+                fits = img.format == 'JPEG' and max(img.size) <= max_dimension
+            if fits:
+                with open(filepath, 'rb') as f:
+                    result = f.read()
+                logger.debug("Image already small, sending original (%sKB)", len(result) // 1024)
+                return result, 'image/jpeg'
+        
         with Image.open(filepath) as img:
             # Convert to RGB if necessary
             if img.mode in ('RGBA', 'P'):
@@ -149,29 +519,31 @@ def compress_image_for_api(filepath, max_size_kb=1024, max_dimension=2500):
                 ratio = max_dimension / max(img.size)
                 new_size = (int(img.size[0] * ratio), int(img.size[1] * ratio))
                 img = img.resize(new_size, Image.Resampling.LANCZOS)
-                print(f"[DEBUG] Resized image to {new_size}")
+                logger.debug("Resized image to %s", new_size)
             
-            # Compress to JPEG with high quality
+            # Single JPEG pass at a quality that keeps document text sharp.
+            # optimize=False skips Pillow's extra Huffman-table pass; the size
+            # difference is a few percent and max_size_kb still bounds it.
             buffer = io.BytesIO()
-            quality = 90  # Start higher for better OCR
-            # Optimize=True strips metadata which can cause issues
-            img.save(buffer, format='JPEG', quality=quality, optimize=True, subsampling=0)
+            quality = 85
+            img.save(buffer, format='JPEG', quality=quality, optimize=False, subsampling=0)
             
-            # Reduce quality if still too large
-            while buffer.tell() > max_size_kb * 1024 and quality > 50:
+            # Only re-encode when the first pass is over budget. JPEG size falls
+            # roughly with the square of quality, so jump straight to an
+            # estimate instead of stepping down 10 at a time.
+            budget = max_size_kb * 1024
+            while buffer.tell() > budget and quality > 45:
+                estimate = int(quality * (budget / buffer.tell()) ** 0.5)
+                quality = max(45, min(quality - 5, estimate))
                 buffer.seek(0)
                 buffer.truncate()
-                quality -= 10
-                img.save(buffer, format='JPEG', quality=quality, optimize=True, subsampling=0)
+                img.save(buffer, format='JPEG', quality=quality, optimize=False, subsampling=0)
             
-            buffer.seek(0)
-            result = base64.b64encode(buffer.read()).decode('utf-8')
-            size_kb = len(result) // 1024
-            buffer.close()
-            print(f"[DEBUG] Compressed image to {size_kb}KB base64 (Quality: {quality})")
+            result = buffer.getvalue()
+            logger.debug("Compressed image to %sKB (Quality: %s)", len(result) // 1024, quality)
             return result, 'image/jpeg'
     except Exception as e:
-        print(f"[WARN] Image compression failed: {e}, using original")
+        logger.warning("Image compression failed: %s, using original", e)
         # If compression fails, try to just read and encode original if it's an image
         try:
             with open(filepath, "rb") as f:
@@ -179,376 +551,468 @@ def compress_image_for_api(filepath, max_size_kb=1024, max_dimension=2500):
                 # Check for magic numbers: PNG, JPEG
                 if header.startswith(b'\x89PNG') or header.startswith(b'\xff\xd8'):
                     f.seek(0)
-                    encoded = base64.b64encode(f.read()).decode('utf-8')
                     mime = 'image/png' if header.startswith(b'\x89PNG') else 'image/jpeg'
-                    return encoded, mime
+                    return f.read(), mime
         except:
             pass
         return None, None
 
+def load_image_for_api(filepath, max_dimension=2500):
+    """Return (image_bytes, mime_type) for an image file, compressed when possible."""
+    # Try compressed version first (saves memory). Pillow work runs on the
+    # shared IMAGE_POOL so concurrent extractions overlap network waits with
+    # at most IMAGE_POOL_WORKERS full-resolution images decoded at once.
+    image_bytes, mime_type = IMAGE_POOL.submit(compress_image_for_api, filepath, max_dimension=max_dimension).result()
+    
+    if not image_bytes:
+        # compress_image_for_api already falls back to the raw bytes of any
+        # PNG/JPEG; anything else (e.g. a PDF) would be rejected by Vision
+        raise ValueError(f"Not a readable PNG/JPEG image: {filepath}")
+    return image_bytes, mime_type
+
+@cached_extraction('openai', 'gpt-4o', prompt_version('identity', IDENTITY_PROMPT))
 def extract_data_from_image(filepath):
     """Extract data from an image using OpenAI Vision API."""
-    if not openai_client:
-        print("Warning: OPENAI_API_KEY not set. Skipping image extraction.")
+    if not openai_key:
+        logger.warning("OPENAI_API_KEY not set. Skipping image extraction.")
         return {}
     
     try:
-        # Try compressed version first (saves memory)
-        base64_image, mime_type = compress_image_for_api(filepath)
-        
-        if not base64_image:
-            # Fallback to original
-            with open(filepath, "rb") as image_file:
-                base64_image = base64.b64encode(image_file.read()).decode('utf-8')
-            ext = filepath.lower().split('.')[-1]
-            mime_type = f"image/{ext}" if ext in ['png', 'jpg', 'jpeg'] else "image/jpeg"
-            if ext == 'jpg':
-                mime_type = "image/jpeg"
-        
-        # Improved prompt for Brazilian identity documents with emphasis on OCR correction
-        identity_prompt = """Você é um especialista em OCR e extração de dados de documentos brasileiros.
-
-Analise esta imagem de documento de identificação (CNH, RG, CIN, Passaporte) e extraia os dados com MÁXIMA precisão.
-
-CAMPOS CRÍTICOS (Obrigatórios):
-- name: Nome completo (NOME). Se estiver em várias linhas, concatene. Corrija erros óbvios de OCR (ex: '0' em vez de 'O', '1' em vez de 'I').
-- cpf: O CPF é crucial. Procure formato XXX.XXX.XXX-XX. Se houver dígitos suspeitos, tente inferir pelo contexto.
-- birth_date: Data de nascimento (NASCIMENTO). Formato DD/MM/AAAA.
-
-CAMPOS ADICIONAIS:
-- nationality: Nacionalidade.
-- civil_state: Estado civil.
-- rg: Número do RG/Registro Geral.
-- rg_issuer: Órgão emissor (ex: SSP/SP, DETRAN/RJ).
-- cnh_number: Número de registro da CNH (se for CNH).
-- address: Endereço (se houver).
-- mother_name: Nome da mãe (FILIAÇÃO).
-- father_name: Nome do pai (FILIAÇÃO).
-
-DICAS DE EXTRAÇÃO:
-- CNH: O nome fica no topo. O CPF fica abaixo da foto ou no verso.
-- RG Antigo: Nome e filiação no verso.
-- CIN (RG Novo): QR Code no verso. Dados principais na frente.
-- Ignore marcas d'água, carimbos ou reflexos que atrapalhem a leitura.
-- Se um campo estiver ilegível, retorne null para ele.
-- Retorne APENAS JSON válido."""
-
-        response = openai_client.chat.completions.create(
+        image_bytes, mime_type = load_image_for_api(filepath)
+    except FileNotFoundError:
+        logger.error("Image file not found: %s", filepath)
+        return {}
+    except Exception as e:
+        logger.error("Could not read image %s: %s", filepath, e)
+        return {}
+    return extract_identity_with_vision(image_bytes, mime_type)
+
+@cached_extraction('openai', 'gpt-4o', prompt_version('identity', IDENTITY_PROMPT), source='bytes')
+def extract_data_from_image_bytes(jpeg_bytes):
+    """Extract identity data from an in-memory JPEG (e.g. a rendered PDF page)."""
+    if not openai_key:
+        logger.warning("OPENAI_API_KEY not set. Skipping image extraction.")
+        return {}
+    # Already a right-sized JPEG, so skip compress_image_for_api entirely
+    return extract_identity_with_vision(jpeg_bytes, 'image/jpeg')
+
+def extract_identity_with_vision(image_bytes, mime_type):
+    """Send an identity document image to OpenAI Vision and parse the JSON reply."""
+    content = None
+    try:
+        response = get_openai_client().chat.completions.create(
             model="gpt-4o",
-            messages=[
-                {
-                    "role": "user",
-                    "content": [
-                        {
-                            "type": "text",
-                            "text": identity_prompt
-                        },
-                        {
-                            "type": "image_url",
-                            "image_url": {
-                                "url": f"data:{mime_type};base64,{base64_image}",
-                                "detail": "high"  # Use high detail for better OCR
-                            }
-                        }
-                    ]
-                }
-            ],
-            response_format={"type": "json_object"},
-            max_tokens=1000
+            # Use high detail for better OCR
+            messages=vision_messages(IDENTITY_PROMPT, image_part(image_bytes, mime_type, "high")),
+            response_format=JSON_OBJECT_FORMAT,
+            max_tokens=1000,
+            **prompt_cache_options(IDENTITY_CACHE_KEY)
         )
         content = response.choices[0].message.content
-        print(f"[DEBUG] Raw OpenAI Vision response: {content}")
+        logger.debug("Raw OpenAI Vision response: %s", content)
         
-        result = json.loads(content)
-        print(f"[DEBUG] Parsed JSON: {result}")
-        
-        # Explicit memory cleanup
-        del base64_image
-        gc.collect()
+        result = orjson.loads(content)
+        logger.debug("Parsed JSON: %s", result)
         
         return result
-    except json.JSONDecodeError as e:
-        print(f"[ERROR] Invalid JSON from OpenAI Vision: {e}. Content: {content}")
-        return {}
-    except FileNotFoundError:
-        print(f"[ERROR] Image file not found: {filepath}")
+    except orjson.JSONDecodeError as e:
+        logger.error("Invalid JSON from OpenAI Vision: %s. Content: %s", e, content)
         return {}
     except Exception as e:
-        print(f"[ERROR] OpenAI Image Extraction Error: {e}")
-        traceback.print_exc()
+        logger.exception("OpenAI Image Extraction Error: %s", e)
         return {}
 
+# Utility bills print the address in large type: "low" detail is a flat ~85
+# tokens instead of several high-detail tiles. Identity docs keep "high"
+# because CPF/RG digits need it. Set ADDRESS_VISION_DETAIL=high to revert.
+ADDRESS_VISION_DETAIL = os.getenv('ADDRESS_VISION_DETAIL', 'low')
+ADDRESS_MAX_DIMENSION = 768 if ADDRESS_VISION_DETAIL == 'low' else 2500
+
+@cached_extraction('openai', 'gpt-4o', prompt_version(f'address_{ADDRESS_VISION_DETAIL}', ADDRESS_PROMPT))
 def extract_address_from_proof(filepath):
     """Extract address data from utility bills or address proof documents."""
-    if not openai_client:
-        print("Warning: OPENAI_API_KEY not set. Skipping address extraction.")
+    if not openai_key:
+        logger.warning("OPENAI_API_KEY not set. Skipping address extraction.")
         return {}
     
     try:
-        # Use compression for address proofs too
-        base64_image, mime_type = compress_image_for_api(filepath)
-        
-        if not base64_image:
-            with open(filepath, "rb") as image_file:
-                base64_image = base64.b64encode(image_file.read()).decode('utf-8')
-            ext = filepath.lower().split('.')[-1]
-            mime_type = f"image/{ext}" if ext in ['png', 'jpg', 'jpeg'] else "image/jpeg"
-            if ext == 'jpg':
-                mime_type = "image/jpeg"
-
-        
-        address_prompt = """Você é um especialista em OCR de comprovantes de residência brasileiros.
-
-Analise esta imagem (conta de luz, água, telefone, internet ou fatura de cartão) e extraia o endereço com precisão.
-
-CAMPOS OBRIGATÓRIOS:
-- street: Logradouro (Rua, Av, Praça, etc) + Nome.
-- number: Número do imóvel. Se for 'S/N', retorne 'S/N'.
-- complement: Complemento (Ex: Apto 101, Bloco B).
-- neighborhood: Bairro.
-- city: Cidade.
-- state: Estado (UF, sigla de 2 letras).
-- zipcode: CEP (formato XXXXX-XXX).
-
-DICAS:
-- O endereço geralmente fica no topo, perto do nome do titular, ou no corpo da fatura.
-- Ignore endereços da empresa emissora da conta (ex: Enel, Sabesp, Claro). Procure o endereço do CLIENTE/DESTINATÁRIO.
-- Se houver códigos de barras ou números aleatórios, IGNORE.
-- Corrija erros comuns de OCR (ex: 'Rva' -> 'Rua').
+        # Address proofs are sent at lower detail, so a smaller image is enough
+        image_bytes, mime_type = load_image_for_api(filepath, max_dimension=ADDRESS_MAX_DIMENSION)
+    except FileNotFoundError:
+        logger.error("Address file not found: %s", filepath)
+        return {}
+    except Exception as e:
+        logger.error("Could not read address file %s: %s", filepath, e)
+        return {}
+    return extract_address_with_vision(image_bytes, mime_type)
 
-Retorne APENAS um objeto JSON válido."""
+@cached_extraction('openai', 'gpt-4o', prompt_version(f'address_{ADDRESS_VISION_DETAIL}', ADDRESS_PROMPT), source='bytes')
+def extract_address_from_proof_bytes(jpeg_bytes):
+    """Extract address data from an in-memory JPEG (e.g. a rendered PDF page)."""
+    if not openai_key:
+        logger.warning("OPENAI_API_KEY not set. Skipping address extraction.")
+        return {}
+    return extract_address_with_vision(jpeg_bytes, 'image/jpeg')
 
-        response = openai_client.chat.completions.create(
+def extract_address_with_vision(image_bytes, mime_type, detail=None):
+    """Send an address proof image to OpenAI Vision and parse the JSON reply."""
+    try:
+        response = get_openai_client().chat.completions.create(
             model="gpt-4o",
-            messages=[
-                {
-                    "role": "user",
-                    "content": [
-                        {"type": "text", "text": address_prompt},
-                        {
-                            "type": "image_url",
-                            "image_url": {
-                                "url": f"data:{mime_type};base64,{base64_image}",
-                                "detail": "high"
-                            }
-                        }
-                    ]
-                }
-            ],
-            response_format={"type": "json_object"},
-            max_tokens=800
+            messages=vision_messages(ADDRESS_PROMPT,
+                                     image_part(image_bytes, mime_type, detail or ADDRESS_VISION_DETAIL)),
+            response_format=JSON_OBJECT_FORMAT,
+            max_tokens=800,
+            **prompt_cache_options(ADDRESS_CACHE_KEY)
         )
-        result = json.loads(response.choices[0].message.content)
-        print(f"[DEBUG] Address proof extraction result: {result}")
+        result = orjson.loads(response.choices[0].message.content)
+        logger.debug("Address proof extraction result: %s", result)
         return result
-    except json.JSONDecodeError as e:
-        print(f"[ERROR] Invalid JSON from address extraction: {e}")
+    except orjson.JSONDecodeError as e:
+        logger.error("Invalid JSON from address extraction: %s", e)
         return {}
-    except FileNotFoundError:
-        print(f"[ERROR] Address file not found: {filepath}")
+    except Exception as e:
+        logger.error("Address Extraction Error: %s", e)
+        return {}
+
+IMAGE_EXTENSIONS = ('.jpg', '.jpeg', '.png')
+
+@cached_extraction('openai', 'gpt-4o', prompt_version(f'partner_{ADDRESS_VISION_DETAIL}', PARTNER_PROMPT), source='files')
+def extract_partner_with_vision(filepaths):
+    """
+    Extract identity and address data for one partner in a single Vision call.
+    `filepaths` is (identity_image, address_image); returns {'identity': {...}, 'address': {...}}.
+    """
+    if not openai_key:
+        logger.warning("OPENAI_API_KEY not set. Skipping image extraction.")
+        return {}
+    
+    identity_path, address_path = filepaths
+    try:
+        identity_bytes, identity_mime = load_image_for_api(identity_path)
+        address_bytes, address_mime = load_image_for_api(address_path, max_dimension=ADDRESS_MAX_DIMENSION)
+    except Exception as e:
+        logger.error("Could not read partner images %s: %s", filepaths, e)
+        return {}
+    
+    try:
+        response = get_openai_client().chat.completions.create(
+            model="gpt-4o",
+            # Identity first (high detail for OCR), then the proof of address
+            messages=vision_messages(PARTNER_PROMPT,
+                                     image_part(identity_bytes, identity_mime, "high"),
+                                     image_part(address_bytes, address_mime, ADDRESS_VISION_DETAIL)),
+            response_format=JSON_OBJECT_FORMAT,
+            max_tokens=1800,
+            **prompt_cache_options(PARTNER_CACHE_KEY)
+        )
+        result = orjson.loads(response.choices[0].message.content)
+        logger.debug("Combined partner extraction result: %s", result)
+        return result if isinstance(result, dict) else {}
+    except orjson.JSONDecodeError as e:
+        logger.error("Invalid JSON from combined partner extraction: %s", e)
         return {}
     except Exception as e:
-        print(f"[ERROR] Address Extraction Error: {e}")
+        logger.exception("Combined Partner Extraction Error: %s", e)
         return {}
 
+# JSON object with possibly nested braces, for replies wrapped in prose/markdown
+JSON_DECODER = json.JSONDecoder()
+
+def parse_json_reply(content):
+    """Parse a model reply that should be a JSON object, tolerating surrounding text."""
+    stripped = content.strip()
+    # The prompt asks for JSON only, so the common case needs no regex at all
+    if stripped.startswith('{') and stripped.endswith('}'):
+        try:
+            return orjson.loads(stripped)
+        except orjson.JSONDecodeError:
+            pass
+    # Otherwise decode the first complete object embedded in the text (any
+    # nesting depth, linear scan; a stray "{" in prose is skipped)
+    start = content.find('{')
+    while start != -1:
+        try:
+            obj, _ = JSON_DECODER.raw_decode(content, start)
+            if isinstance(obj, dict):
+                return obj
+        except ValueError:
+            pass
+        start = content.find('{', start + 1)
+    return {}
+
+def read_until_json_closes(deltas):
+    """
+    Accumulate streamed text deltas and stop once the first top-level JSON
+    object is closed (braces inside strings are ignored).
+    """
+    parts = []
+    depth = 0
+    in_string = escaped = False
+    for delta in deltas:
+        if not isinstance(delta, str) or not delta:
+            continue
+        parts.append(delta)
+        for ch in delta:
+            if in_string:
+                if escaped:
+                    escaped = False
+                elif ch == '\\':
+                    escaped = True
+                elif ch == '"':
+                    in_string = False
+            elif ch == '"' and depth:
+                in_string = True
+            elif ch == '{':
+                depth += 1
+            elif ch == '}' and depth:
+                depth -= 1
+                if depth == 0:
+                    return ''.join(parts)
+    return ''.join(parts)
+
+@cached_extraction('mistral', 'mistral-small-latest', prompt_version('parse', MISTRAL_PROMPT), source='text', text_limit=10000)
 def extract_data_with_mistral_chat(text):
     """Parse extracted text using Mistral chat API (text only, not vision)."""
+    mistral_client = get_mistral_client()
     if not mistral_client or not text:
         return None
     
     try:
-        print(f"[DEBUG] Using Mistral chat for text parsing, length: {len(text)}")
+        logger.debug("Using Mistral chat for text parsing, length: %s", len(text))
         
         assert mistral_client is not None  # Already checked above
-        
-        prompt = """Analise o texto a seguir e extraia as informações em formato JSON.
-
-Para documentos de identidade (RG, CNH, CIN):
-- name (Nome Completo)
-- nationality (Nacionalidade)  
-- civil_state (Estado Civil, se visível)
-- birth_date (Data de Nascimento no formato DD/MM/AAAA)
-- cpf (CPF, se visível)
-- address (Endereço completo formatado como: Rua Nome, Número, Bairro, Cidade/UF, CEP)
-
-Para documentos de empresa (Contrato Social, Cartão CNPJ):
-- company_name (Razão Social completa)
-- company_address (Endereço da Sede formatado como: Logradouro, Número, Complemento, Bairro, Cidade/UF, CEP 00000-000)
-- company_object (Objeto Social resumido)
-- company_cnae_list (Lista de CNAEs/Atividades separadas por vírgula)
-- start_date (Data de Início no formato DD/MM/AAAA)
-- capital_currency (Capital Social em R$)
-- total_quotas (Total de Quotas)
-- quota_value (Valor por Quota)
-- forum_city (Cidade do Foro)
-
-IMPORTANTE: Formate os endereços de forma limpa e legível, removendo quebras de linha e caracteres estranhos.
-
-Retorne APENAS o JSON. Texto do documento:
-"""
-        response = mistral_client.chat.complete(
+        # Stream so we can hang up as soon as the JSON object is complete,
+        # without waiting for (or paying for) any trailing commentary
+        with mistral_client.chat.stream(
             model="mistral-small-latest",  # Text model, not vision
             messages=[
-                {"role": "user", "content": f"{prompt}\n\n{text[:10000]}"}
-            ]
-        )
+                {"role": "user", "content": f"{MISTRAL_PROMPT}\n\n{text[:10000]}"}
+            ],
+            # JSON mode: the reply is a bare object, so parse_json_reply takes
+            # its orjson fast path instead of scanning prose
+            response_format=JSON_OBJECT_FORMAT
+        ) as stream:
+            content = read_until_json_closes(
+                event.data.choices[0].delta.content for event in stream if event.data.choices
+            )
         
-        content = response.choices[0].message.content
-        print(f"[DEBUG] Mistral chat response: {content[:300]}...")
+        logger.debug("Mistral chat response: %s...", content[:300])
         
-        # Try to find JSON object with possibly nested braces
-        json_match = re.search(r'\{[^{}]*(?:\{[^{}]*\}[^{}]*)*\}', content, re.DOTALL)
-        if json_match:
-            result = json.loads(json_match.group())
-            print(f"[DEBUG] Mistral extracted: {result}")
-            return result
-        return {}
+        result = parse_json_reply(content)
+        if result:
+            logger.debug("Mistral extracted: %s", result)
+        return result
         
     except Exception as e:
-        print(f"[ERROR] Mistral chat error: {e}")
+        logger.error("Mistral chat error: %s", e)
         return None
 
-def convert_pdf_to_image(filepath):
-    """Convert PDF first page to image for OCR processing."""
-    print(f"[DEBUG] Converting PDF to image: {filepath}")
+# Vision downsamples to ~2048px anyway; rendering finer only costs memory
+PDF_RENDER_DPI = 200
+
+def convert_pdf_to_image(filepath, max_dimension=2500, jpeg_quality=85, doc=None):
+    """
+    Render the PDF first page for OCR processing.
+    Returns JPEG bytes ready for the Vision API (no temp file), or None.
+    `doc` may be the already-open PyMuPDF document for `filepath`.
+    """
+    logger.debug("Converting PDF to image: %s", filepath)
     
-    # Try pdf2image first (requires poppler)
-    if PDF2IMAGE_AVAILABLE and convert_from_path is not None:
+    # PyMuPDF renders in-process; pdf2image forks poppler's pdftoppm
+    fitz = get_fitz()
+    if fitz is not None:
         try:
-            print("[DEBUG] Attempting pdf2image conversion with high DPI...")
-            images = convert_from_path(filepath, first_page=1, last_page=1, dpi=300)  # Professional OCR standard
-            if images:
-                img_path = filepath.replace('.pdf', '_page1.png')
-                images[0].save(img_path, 'PNG')
-                del images  # Explicit cleanup
-                gc.collect()
-                print(f"[DEBUG] Content check: {os.path.getsize(img_path)} bytes")
-                print(f"[DEBUG] Converted PDF to image: {img_path}")
-                return img_path
-            else:
-                print("[WARN] pdf2image returned empty list")
+            logger.debug("Attempting PyMuPDF (fitz) conversion...")
+            with nullcontext(doc) if doc is not None else fitz.open(filepath) as pdf:
+                if pdf.page_count < 1:
+                    logger.error("PDF has no pages")
+                    return None
+                
+                page = pdf[0]
+                # 200 DPI keeps document text legible for OCR; large pages are
+                # capped so the longest side fits max_dimension (PDF points are 1/72 in)
+                dpi = min(PDF_RENDER_DPI, int(72 * max_dimension / max(page.rect.width, page.rect.height)))
+                pix = page.get_pixmap(dpi=dpi, colorspace=fitz.csRGB, alpha=False)
+                image_bytes = pix.tobytes("jpeg", jpg_quality=jpeg_quality)
+                del pix  # Explicit cleanup
+            
+            logger.debug("Converted PDF to JPEG with PyMuPDF: %s bytes", len(image_bytes))
+            return image_bytes
+                
         except Exception as e:
-            print(f"[WARN] PDF to image conversion failed: {e}")
+            logger.warning("PyMuPDF conversion failed: %s", e, exc_info=True)
+    else:
+        logger.warning("PyMuPDF unavailable")
     
-    # Fallback to PyMuPDF (fitz)
-    if FITZ_AVAILABLE and fitz is not None:
+    # Fallback to pdf2image (requires poppler)
+    convert_from_path = get_convert_from_path()
+    if convert_from_path is not None:
         try:
-            print("[DEBUG] Attempting PyMuPDF (fitz) conversion...")
-            doc = fitz.open(filepath)
-            if doc.page_count < 1:
-                print("[ERROR] PDF has no pages")
-                return None
-                
-            page = doc[0]
-            pix = page.get_pixmap(dpi=150)  # Optimized for free tier memory limits
-            img_path = filepath.replace('.pdf', '_page1.png')
-            pix.save(img_path)
-            del pix  # Explicit cleanup
-            doc.close()
-            gc.collect()
-            
-            if os.path.exists(img_path):
-                print(f"[DEBUG] Content check: {os.path.getsize(img_path)} bytes")
-                print(f"[DEBUG] Converted PDF to image with PyMuPDF: {img_path}")
-                return img_path
+            logger.debug("Attempting pdf2image conversion...")
+            images = convert_from_path(filepath, first_page=1, last_page=1, dpi=PDF_RENDER_DPI)
+            if images:
+                img = images[0]
+                del images  # Explicit cleanup
+                # Keep within the Vision API size budget (same bound as compress_image_for_api)
+                img.thumbnail((max_dimension, max_dimension), Image.Resampling.LANCZOS)
+                buffer = io.BytesIO()
+                img.convert('RGB').save(buffer, format='JPEG', quality=jpeg_quality)
+                image_bytes = buffer.getvalue()
+                del img, buffer
+                logger.debug("Converted PDF to JPEG: %s bytes", len(image_bytes))
+                return image_bytes
             else:
-                print("[ERROR] PyMuPDF claimed success but file not found")
-                
+                logger.warning("pdf2image returned empty list")
         except Exception as e2:
-            print(f"[WARN] PyMuPDF conversion also failed: {e2}")
-            traceback.print_exc()
-    else:
-        print(f"[WARN] PyMuPDF unavailable (Available={FITZ_AVAILABLE}, Module={fitz})")
+            logger.warning("pdf2image conversion also failed: %s", e2)
     
-    print("[WARN] No PDF to image converter available or all failed")
+    logger.warning("No PDF to image converter available or all failed")
     return None
 
-def extract_document_data(filepath):
-    """Main extraction function - handles both text-based and image-based documents."""
-    print(f"[DEBUG] Extracting data from: {filepath}")
-    
-    ext = filepath.lower().split('.')[-1]
+# A short PDF text layer is only trusted if it yields at least one of these
+PDF_KEY_FIELDS = ('name', 'cpf', 'company_name')
+
+def extract_pdf_data(filepath, doc=None, service_options=INTERACTIVE_SERVICE_OPTIONS):
+    """PDF half of extract_document_data; `doc` is the open PyMuPDF document, if any."""
+    # For PDFs: first try text extraction
+    # Only the first PDF_TEXT_LIMIT chars are ever sent to the parsers
+    text = extract_text_from_pdf(filepath, max_chars=PDF_TEXT_LIMIT, doc=doc)
+    text_length = len(text.strip()) if text else 0
+    logger.debug("PDF text extracted, length: %s", text_length)
     
-    if ext == 'pdf':
-        # For PDFs: first try text extraction
-        text = extract_text_from_pdf(filepath)
-        text_length = len(text.strip()) if text else 0
-        print(f"[DEBUG] PDF text extracted, length: {text_length}")
+    # If PDF has substantial text (>500 chars), use text parsing
+    if text_length > 500:
+        logger.debug("Text-based PDF detected, using Mistral/OpenAI text parsing")
         
-        # If PDF has substantial text (>500 chars), use text parsing
-        if text_length > 500:
-            print(f"[DEBUG] Text-based PDF detected, using Mistral/OpenAI text parsing")
-            
-            # Try Mistral first (it's free for text parsing)
+        # Try Mistral first (it's free for text parsing)
+        result = extract_data_with_mistral_chat(text)
+        if result is not None and len(result) > 0:
+            logger.debug("Mistral parsing succeeded with %s fields", len(result))
+            return result
+        
+        # Fallback to OpenAI
+        logger.debug("Falling back to OpenAI for text parsing")
+        return extract_data_with_ai(text, service_options)
+    else:
+        # Scans often carry a thin text layer; when it is enough to identify
+        # the document, the cheap text parser saves a rasterize + Vision call
+        if text_length >= 100:
+            logger.debug("Short text layer (%s chars), trying Mistral text parsing first", text_length)
             result = extract_data_with_mistral_chat(text)
-            if result is not None and len(result) > 0:
-                print(f"[DEBUG] Mistral parsing succeeded with {len(result)} fields")
+            if result and any(result.get(field) for field in PDF_KEY_FIELDS):
+                logger.debug("Mistral parsing of short text layer succeeded with %s fields", len(result))
                 return result
-            
-            # Fallback to OpenAI
-            print(f"[DEBUG] Falling back to OpenAI for text parsing")
-            return extract_data_with_ai(text)
-        else:
-            # Image-based PDF (like identity documents) - need OCR
-            print(f"[DEBUG] Image-based PDF detected ({text_length} chars), using Vision API")
-            
-            # Try to convert PDF to image first
-            img_path = convert_pdf_to_image(filepath)
-            if img_path:
-                result = extract_data_from_image(img_path)
-                if result:
-                    return result
-            
-            # If conversion failed, do NOT send PDF to Vision API.
-            # Instead, try a text extraction fallback with OCR if possible, or fail gracefully.
-            print("[WARN] PDF-to-Image conversion failed. Skipping Vision API to avoid invalid_image_format error.")
-            return {}
+        
+        # Image-based PDF (like identity documents) - need OCR
+        logger.debug("Image-based PDF detected (%s chars), using Vision API", text_length)
+        
+        # Try to convert PDF to image first
+        image_bytes = convert_pdf_to_image(filepath, doc=doc)
+        if image_bytes:
+            result = extract_data_from_image_bytes(image_bytes)
+            if result:
+                return result
+        
+        # If conversion failed, do NOT send PDF to Vision API.
+        # Instead, try a text extraction fallback with OCR if possible, or fail gracefully.
+        logger.warning("PDF-to-Image conversion failed. Skipping Vision API to avoid invalid_image_format error.")
+        return {}
+
+def extract_document_data(filepath, service_options=INTERACTIVE_SERVICE_OPTIONS):
+    """
+    Main extraction function - handles both text-based and image-based documents.
+    `service_options` go to the OpenAI text parser (COMPANY_SERVICE_OPTIONS for
+    company documents).
+    """
+    logger.debug("Extracting data from: %s", filepath)
+    
+    ext = filepath.lower().split('.')[-1]
+    
+    if ext == 'pdf':
+        # One PyMuPDF parse serves both the text layer and the page render
+        doc = open_pdf_document(filepath)
+        try:
+            return extract_pdf_data(filepath, doc, service_options)
+        finally:
+            if doc is not None:
+                doc.close()
             
     elif ext in ['jpg', 'jpeg', 'png']:
         # For images: use OpenAI Vision directly
-        print(f"[DEBUG] Image file detected, sending to OpenAI Vision: {filepath}")
+        logger.debug("Image file detected, sending to OpenAI Vision: %s", filepath)
         return extract_data_from_image(filepath)
     
-    print(f"[WARN] Unsupported file extension: {ext}")
+    logger.warning("Unsupported file extension: %s", ext)
+    return {}
+
+def extract_address_data(filepath):
+    """Address proof extraction for any supported upload (PDF or image)."""
+    ext = filepath.lower().split('.')[-1]
+    
+    if ext == 'pdf':
+        doc = open_pdf_document(filepath)
+        try:
+            # Convert PDF to image for address extraction, as small as photos are
+            image_bytes = convert_pdf_to_image(filepath, max_dimension=ADDRESS_MAX_DIMENSION, doc=doc)
+            if image_bytes:
+                return extract_address_from_proof_bytes(image_bytes)
+            
+            # Vision cannot read a PDF sent as an image, so use the text layer instead
+            logger.warning("PDF-to-Image conversion failed for address proof, trying its text layer")
+            text = extract_text_from_pdf(filepath, max_chars=PDF_TEXT_LIMIT, doc=doc)
+        finally:
+            if doc is not None:
+                doc.close()
+        if not text.strip():
+            return {}
+        parsed = extract_data_with_mistral_chat(text) or extract_data_with_ai(text)
+        if parsed and parsed.get('address'):
+            return {'full_address': parsed['address']}
+        return {}
+    
+    elif ext in ['jpg', 'jpeg', 'png']:
+        return extract_address_from_proof(filepath)
+    
+    logger.warning("Unsupported address proof extension: %s", ext)
     return {}
 
+# Required fields checked by is_contract_complete (based on form inputs).
+# Note: 'regime' is skipped as it depends on civil_state
+REQUIRED_PARTNER_FIELDS = (
+    'name', 'nationality', 'civil_state', 'profession',
+    'birth_date', 'cpf', 'address', 'quotas', 'amount', 'percent'
+)
+REQUIRED_COMPANY_FIELDS = (
+    'company_name', 'company_address', 'company_object',
+    'company_cnae_list', 'start_date', 'capital_currency',
+    'signature_date'
+)
+EMPTY_VALUES = frozenset({'', 'none', 'null', 'undefined'})
+PLACEHOLDER_PREFIXES = ('...', '___')
+
+def is_empty_value(val):
+    """True for None, blank strings, "None"/"null"/"undefined" and "..."/"___" placeholders."""
+    if val is None:
+        return True
+    s = (val if isinstance(val, str) else str(val)).strip()
+    return s.lower() in EMPTY_VALUES or s.startswith(PLACEHOLDER_PREFIXES)
+
 def is_contract_complete(contract):
     """
     Check if a contract is complete (all fields filled, no placeholders).
     Returns tuple: (is_complete: bool, missing_fields: list)
     """
-    # Define required fields based on form inputs
-    required_partner_fields = [
-        'name', 'nationality', 'civil_state', 'profession', 
-        'birth_date', 'cpf', 'address', 'quotas', 'amount', 'percent'
-    ]
-    # Note: 'regime' is skipped as it depends on civil_state
-    
-    required_company_fields = [
-        'company_name', 'company_address', 'company_object', 
-        'company_cnae_list', 'start_date', 'capital_currency', 
-        'signature_date'
-    ]
-
     missing_fields = []
     
-    # Helper to check if value is empty or placeholder
-    def is_empty(val):
-        if val is None: return True
-        s = str(val).strip()
-        # Check for empty, "None", "undefined", or common placeholders like "..." or "_"
-        if s == '' or s.lower() in ['none', 'null', 'undefined'] or s.startswith('...') or s.startswith('___'):
-            return True
-        return False
-
     # Check partners
     partners = contract.get('partners', [])
     if not partners:
         missing_fields.append('no_partners_added')
     
     for i, partner in enumerate(partners):
-        for field in required_partner_fields:
-            if is_empty(partner.get(field)):
+        for field in REQUIRED_PARTNER_FIELDS:
+            if is_empty_value(partner.get(field)):
                 missing_fields.append(f'partner_{i}_{field}')
 
     # Check company data
@@ -556,43 +1020,60 @@ def is_contract_complete(contract):
     if not company_data:
         missing_fields.append('no_company_data')
     else:
-        for field in required_company_fields:
-            if is_empty(company_data.get(field)):
+        for field in REQUIRED_COMPANY_FIELDS:
+            if is_empty_value(company_data.get(field)):
                 missing_fields.append(f'company_{field}')
     
     is_complete = len(missing_fields) == 0
     return is_complete, missing_fields
 
+# Dashboard listing: only the columns the page uses, one page at a time
+DASHBOARD_COLUMNS = 'id,name,status,partners,company_data,created_at'
+DASHBOARD_PAGE_SIZE = 50
+# Single-contract views only pull the JSON columns they actually use
+EDIT_COLUMNS = 'partners,company_data'
+DOWNLOAD_COLUMNS = 'company_data'
+
 @app.route('/')
 def index():
     """Dashboard page - lists all contracts from Supabase."""
     contracts = []
+    total_count = 0
     drafts_count = 0
     completed_count = 0
+    has_next = False
+    try:
+        page = max(0, int(request.args.get('page', 0)))
+    except (ValueError, TypeError):
+        page = 0
     
     if supabase_client:
         try:
-            print("[DEBUG] Fetching contracts from Supabase...")
-            response = supabase_client.table('contracts').select('*').order('created_at').execute()
+            logger.debug("Fetching contracts page %s from Supabase...", page)
+            # Newest first, sorted server-side; fetch one extra row to know if there is a next page
+            start = page * DASHBOARD_PAGE_SIZE
+            response = execute_with_reconnect(supabase_client.table('contracts')
+                                              .select(DASHBOARD_COLUMNS)
+                                              .order('created_at', desc=True)
+                                              .range(start, start + DASHBOARD_PAGE_SIZE))
             contracts = response.data if response.data else []
-            print(f"[DEBUG] Fetched {len(contracts)} contracts")
-            
-            # Show newest first
-            contracts.reverse()
+            has_next = len(contracts) > DASHBOARD_PAGE_SIZE
+            contracts = contracts[:DASHBOARD_PAGE_SIZE]
+            logger.debug("Fetched %s contracts", len(contracts))
             
             for contract in contracts:
                 # Ensure partners is a list
                 if isinstance(contract.get('partners'), str):
                     try:
-                        contract['partners'] = json.loads(contract['partners'])
-                    except:
+                        contract['partners'] = orjson.loads(contract['partners'])
+                    except orjson.JSONDecodeError:
                         contract['partners'] = []
                 
                 # Ensure company_data is a dict
                 if isinstance(contract.get('company_data'), str):
                     try:
-                        contract['company_data'] = json.loads(contract['company_data'])
-                    except:
+                        contract['company_data'] = orjson.loads(contract['company_data'])
+                    except orjson.JSONDecodeError:
                         contract['company_data'] = {}
 
                 is_complete, missing = is_contract_complete(contract)
@@ -610,17 +1091,28 @@ def index():
                     contract['effective_status'] = 'draft'
                 else:
                     contract['effective_status'] = 'completed'
-            drafts_count = len([c for c in contracts if c.get('effective_status', 'draft') == 'draft'])
-            completed_count = len([c for c in contracts if c.get('effective_status') == 'completed'])
+
+            # The stats cover every contract, not just this page: two head-only
+            # count queries on the stored status (every row is draft or completed).
+            # That is whether /generate ran, not the completeness shown per row,
+            # so the cards are labelled Gerados / Não gerados.
+            total_count = execute_with_reconnect(supabase_client.table('contracts')
+                                                 .select('id', count=CountMethod.exact, head=True)).count or 0
+            completed_count = execute_with_reconnect(supabase_client.table('contracts')
+                                                     .select('id', count=CountMethod.exact, head=True)
+                                                     .eq('status', 'completed')).count or 0
+            drafts_count = total_count - completed_count
             
         except Exception as e:
-            print(f"[ERROR] Failed to fetch contracts: {e}")
-            traceback.print_exc()
+            logger.exception("Failed to fetch contracts: %s", e)
     
     return render_template('dashboard.html', 
                          contracts=contracts,
+                         total_count=total_count,
                          drafts_count=drafts_count,
-                         completed_count=completed_count)
+                         completed_count=completed_count,
+                         page=page,
+                         has_next=has_next)
 
 @app.route('/config')
 def config():
@@ -634,6 +1126,87 @@ def upload():
         partners = 2
     return render_template('upload.html', partner_count=partners)
 
+def remove_upload(filepath):
+    """Delete a temporary upload, ignoring files that are already gone."""
+    _upload_digests.pop(filepath, None)
+    try:
+        os.remove(filepath)
+        logger.debug("Cleaned up: %s", filepath)
+    except OSError:
+        pass
+
+def process_identity_file(filepath):
+    """Extract identity data (CNH, CIN, RG) from a saved upload, then delete it."""
+    try:
+        # Use unified extraction (Mistral OCR preferred, OpenAI fallback)
+        extracted = extract_document_data(filepath)
+        if extracted:
+            logger.debug("Extracted identity data from %s: %s", filepath, extracted)
+        return extracted
+    finally:
+        remove_upload(filepath)
+
+def process_address_file(filepath):
+    """Extract a formatted address from a saved address proof, then delete it."""
+    try:
+        addr_data = extract_address_data(filepath)
+        if not addr_data:
+            return {}
+
+        logger.debug("Extracted address data from %s: %s", filepath, addr_data)
+        address = format_partner_address(addr_data)
+        return {'address': address} if address else {}
+    finally:
+        remove_upload(filepath)
+
+def format_partner_address(addr_data):
+    """Single-line address from an address proof extraction ('' if nothing usable)."""
+    # Use full_address if available, otherwise construct from parts
+    if addr_data.get('full_address'):
+        return addr_data['full_address']
+    if addr_data.get('street'):
+        parts = [
+            addr_data.get('street', ''),
+            addr_data.get('number', ''),
+            addr_data.get('complement', ''),
+            addr_data.get('neighborhood', ''),
+            f"{addr_data.get('city', '')}/{addr_data.get('state', '')}",
+            f"CEP {addr_data.get('zip_code', '')}"
+        ]
+        return ', '.join(p for p in parts if p and p != '/' and p != 'CEP ')
+    return ''
+
+def process_partner_images(filepaths):
+    """Identity + address proof images of one partner in a single Vision call, then delete them."""
+    identity_path, address_path = filepaths
+    try:
+        combined = extract_partner_with_vision(filepaths)
+        extracted = dict(combined.get('identity') or {})
+        address = format_partner_address(combined.get('address') or {})
+        if address:
+            extracted['address'] = address
+        logger.debug("Extracted combined partner data from %s + %s: %s", identity_path, address_path, extracted)
+        return extracted
+    finally:
+        remove_upload(identity_path)
+        remove_upload(address_path)
+
+def process_company_file(filepath):
+    """Extract company data (Contrato Social, Cartão CNPJ) from a saved upload, then delete it."""
+    try:
+        extracted = extract_document_data(filepath, COMPANY_SERVICE_OPTIONS)
+        if extracted:
+            logger.debug("Extracted company data: %s", extracted)
+        return extracted
+    finally:
+        remove_upload(filepath)
+
+# Shared by all /process requests, so concurrent uploads cannot
+# multiply the number of in-flight AI calls per worker (API rate limits).
+# Tasks mostly wait on the network; image decoding is bounded by IMAGE_POOL.
+EXTRACTION_POOL_WORKERS = 16
+EXTRACTION_POOL = ThreadPoolExecutor(max_workers=EXTRACTION_POOL_WORKERS, thread_name_prefix='extract')
+
 @app.route('/process', methods=['POST'])
 def process():
     try:
@@ -644,16 +1217,20 @@ def process():
     company_data = {}
 
     # Check for API keys
-    if not openai_client and not mistral_client:
+    if not openai_key and not mistral_key:
         flash('AVISO: Chaves de API (OpenAI/Mistral) não configuradas. A extração automática não funcionará.', 'error')
 
-    # 1. Process Partners
+    # 1. Save uploads (fast local disk) and queue one extraction task per file.
+    # The task index keeps files of one request apart, and a per-request uuid
+    # keeps concurrent requests uploading the same filenames apart.
+    upload_id = uuid.uuid4().hex
+    tasks = []  # (kind, partner_index, filepath or (identity_path, address_path))
     for i in range(partner_count):
         files = request.files.getlist(f'files_partner_{i}[]')
         address_files = request.files.getlist(f'files_address_{i}[]')
         
         # Initialize with default empty values so the form always has fields
-        partner_info = {
+        partners_data.append({
             'id': i,
             'name': '',
             'nationality': '',
@@ -666,117 +1243,82 @@ def process():
             'quotas': '',
             'amount': '',
             'percent': ''
-        }
+        })
         
-        print(f"[DEBUG] Partner {i}: Found {len(files)} identity files, {len(address_files)} address files")
+        logger.debug("Partner %s: Found %s identity files, %s address files", i, len(files), len(address_files))
         
-        # Process identity documents (CNH, CIN, RG)
-        for file in files:
-            if file.filename:
-                filepath = os.path.join(app.config['UPLOAD_FOLDER'], f"p{i}_{file.filename}")
-                file.save(filepath)
-                print(f"[DEBUG] Saved identity file: {filepath}")
-                
-                # Use unified extraction (Mistral OCR preferred, OpenAI fallback)
-                extracted = extract_document_data(filepath)
-                if extracted:
-                    print(f"[DEBUG] Extracted identity data for partner {i}: {extracted}")
-                    partner_info.update(extracted)
-                
-                # Clean up uploaded file immediately to save memory
-                try:
-                    os.remove(filepath)
-                    print(f"[DEBUG] Cleaned up: {filepath}")
-                except:
-                    pass
+        files = [f for f in files if f.filename]
+        address_files = [f for f in address_files if f.filename]
         
-        # Process address proof documents (utility bills, bank statements)
-        for addr_file in address_files:
-            if addr_file.filename:
-                addr_filepath = os.path.join(app.config['UPLOAD_FOLDER'], f"addr_{i}_{addr_file.filename}")
-                addr_file.save(addr_filepath)
-                print(f"[DEBUG] Saved address proof file: {addr_filepath}")
-                
-                # First try to extract text from PDF
-                ext = addr_filepath.lower().split('.')[-1]
-                img_path = None
-                if ext == 'pdf':
-                    # Convert PDF to image for address extraction
-                    img_path = convert_pdf_to_image(addr_filepath)
-                    if img_path:
-                        addr_data = extract_address_from_proof(img_path)
-                    else:
-                        addr_data = extract_address_from_proof(addr_filepath)
-                else:
-                    addr_data = extract_address_from_proof(addr_filepath)
-                
-                # Clean up temp converted image
-                if img_path and os.path.exists(img_path):
-                    try:
-                        os.remove(img_path)
-                        print(f"[DEBUG] Cleaned temp image: {img_path}")
-                    except:
-                        pass
-                
-                if addr_data:
-                    print(f"[DEBUG] Extracted address data for partner {i}: {addr_data}")
-                    # Use full_address if available, otherwise construct from parts
-                    if addr_data.get('full_address'):
-                        partner_info['address'] = addr_data['full_address']
-                    elif addr_data.get('street'):
-                        # Construct address from parts
-                        parts = [
-                            addr_data.get('street', ''),
-                            addr_data.get('number', ''),
-                            addr_data.get('complement', ''),
-                            addr_data.get('neighborhood', ''),
-                            f"{addr_data.get('city', '')}/{addr_data.get('state', '')}",
-                            f"CEP {addr_data.get('zip_code', '')}"
-                        ]
-                        partner_info['address'] = ', '.join(p for p in parts if p and p != '/' and p != 'CEP ')
-                
-                # Clean up address file
-                try:
-                    os.remove(addr_filepath)
-                    print(f"[DEBUG] Cleaned up: {addr_filepath}")
-                except:
-                    pass
+        # One identity photo + one address photo: a single Vision call reads both
+        if (len(files) == 1 and len(address_files) == 1
+                and files[0].filename.lower().endswith(IMAGE_EXTENSIONS)
+                and address_files[0].filename.lower().endswith(IMAGE_EXTENSIONS)):
+            filepath = os.path.join(app.config['SCRATCH_FOLDER'], f"{upload_id}_p{i}_{len(tasks)}_{files[0].filename}")
+            addr_filepath = os.path.join(app.config['SCRATCH_FOLDER'], f"{upload_id}_addr_{i}_{len(tasks)}_{address_files[0].filename}")
+            save_upload(files[0], filepath)
+            save_upload(address_files[0], addr_filepath)
+            logger.debug("Saved identity + address images: %s, %s", filepath, addr_filepath)
+            tasks.append(('partner', i, (filepath, addr_filepath)))
+            continue
         
-        partners_data.append(partner_info)
-        print(f"[DEBUG] Partner {i} final data: {partner_info}")
+        # Identity documents (CNH, CIN, RG)
+        for file in files:
+            filepath = os.path.join(app.config['SCRATCH_FOLDER'], f"{upload_id}_p{i}_{len(tasks)}_{file.filename}")
+            save_upload(file, filepath)
+            logger.debug("Saved identity file: %s", filepath)
+            tasks.append(('identity', i, filepath))
         
-        # Memory cleanup after each partner
-        gc.collect()
-        print(f"[DEBUG] Memory cleaned after partner {i}")
+        # Address proof documents (utility bills, bank statements)
+        for addr_file in address_files:
+            addr_filepath = os.path.join(app.config['SCRATCH_FOLDER'], f"{upload_id}_addr_{i}_{len(tasks)}_{addr_file.filename}")
+            save_upload(addr_file, addr_filepath)
+            logger.debug("Saved address proof file: %s", addr_filepath)
+            tasks.append(('address', i, addr_filepath))
 
-    # 2. Process Company Docs
+    # Company documents
     company_files = request.files.getlist('files_company[]')
     for file in company_files:
         if file.filename:
-            filepath = os.path.join(app.config['UPLOAD_FOLDER'], f"company_{file.filename}")
-            file.save(filepath)
-            print(f"[DEBUG] Saved company file: {filepath}")
-            
-            # Use unified extraction (Mistral OCR preferred, OpenAI fallback)
-            extracted = extract_document_data(filepath)
-            if extracted:
-                print(f"[DEBUG] Extracted company data: {extracted}")
-                company_data.update(extracted)
-            
-            # Clean up company file immediately
+            filepath = os.path.join(app.config['SCRATCH_FOLDER'], f"{upload_id}_company_{len(tasks)}_{file.filename}")
+            save_upload(file, filepath)
+            logger.debug("Saved company file: %s", filepath)
+            tasks.append(('company', None, filepath))
+
+    # 2. Run the extractions concurrently - each one is a blocking OpenAI/Mistral
+    # call, so threads overlap the network waits (the GIL is released on socket I/O)
+    if tasks:
+        workers = {
+            'partner': process_partner_images,
+            'identity': process_identity_file,
+            'address': process_address_file,
+            'company': process_company_file,
+        }
+        futures = [EXTRACTION_POOL.submit(workers[kind], filepath) for kind, _, filepath in tasks]
+        # Merge in upload order so later files still override earlier ones
+        for (kind, i, _), future in zip(tasks, futures):
             try:
-                os.remove(filepath)
-                print(f"[DEBUG] Cleaned up: {filepath}")
-            except:
-                pass
-    
+                extracted = future.result()
+            except Exception as e:
+                logger.error("%s extraction failed: %s", kind, e)
+                continue
+            if not extracted:
+                continue
+            if kind == 'company':
+                company_data.update(extracted)
+            else:
+                partners_data[i].update(extracted)
+
+    for i, partner_info in enumerate(partners_data):
+        logger.debug("Partner %s final data: %s", i, partner_info)
+
     # Final memory cleanup
     gc.collect()
-    print("[DEBUG] Final memory cleanup completed")
+    logger.debug("Final memory cleanup completed")
 
     # Store in session or pass directly to form
-    print(f"[DEBUG] Final partners count: {len(partners_data)}")
-    print(f"[DEBUG] Final company data: {company_data}")
+    logger.debug("Final partners count: %s", len(partners_data))
+    logger.debug("Final company data: %s", company_data)
 
     # Flash messages based on extraction result
     has_data = any(p.get('name') for p in partners_data) or company_data.get('company_name')
@@ -786,23 +1328,7 @@ def process():
         flash('Dados extraídos com sucesso! Por favor, revise as informações.', 'success')
 
     # Save DRAFT to Supabase
-    contract_id = None
-    if supabase_client:
-        try:
-            draft_payload = {
-                'name': company_data.get('company_name') or f'Rascunho {len(partners_data)} Sócios',
-                'status': 'draft',
-                'partners': partners_data,
-                'company_data': company_data,
-                'updated_at': 'now()'
-            }
-            res = supabase_client.table('contracts').insert(draft_payload).execute()
-            if res.data:
-                contract_id = res.data[0]['id']
-                print(f"[DEBUG] Created DRAFT contract {contract_id}")
-        except Exception as e:
-            print(f"[ERROR] Failed to save draft: {e}")
-            flash('Aviso: Não foi possível salvar o rascunho no banco de dados.', 'warning')
+    contract_id = save_draft(partners_data, company_data)
     
     return render_template('form.html', 
                          partners=partners_data,
@@ -810,116 +1336,262 @@ def process():
                          contract_id=contract_id,
                          partner_count=len(partners_data))
 
+def save_draft(partners_data, company_data):
+    """
+    Save a draft contract and return its id, or None if it was not saved.
+    The write finishes before the form is rendered, so the user is warned
+    when it fails and the form's later /generate save always lands after it.
+    """
+    if not supabase_client:
+        return None
+    contract_id = str(uuid.uuid4())
+    draft_payload = {
+        'name': company_data.get('company_name') or f'Rascunho {len(partners_data)} Sócios',
+        'status': 'draft',
+        'partners': partners_data,
+        'company_data': company_data,
+        'updated_at': datetime.now(timezone.utc).isoformat()
+    }
+    logger.debug("Saving DRAFT contract %s", contract_id)
+    if not persist_contract(contract_id, draft_payload):
+        flash('Aviso: Não foi possível salvar o rascunho no banco de dados.', 'warning')
+        return None
+    return contract_id
+
+PARTNER_KEY_RE = re.compile(r'partner_(\d+)_(\w+)')
+# /generate only receives short text fields; anything bigger or of another
+# content type is rejected before Werkzeug's form parser runs.
+GENERATE_MAX_CONTENT_LENGTH = 64 * 1024
+GENERATE_CONTENT_TYPES = frozenset(('application/x-www-form-urlencoded', 'multipart/form-data'))
+PARTNER_FIELDS = ('name', 'nationality', 'civil_state', 'regime', 'profession', 'birth_date',
+                  'cpf', 'address', 'quotas', 'amount', 'percent')
+# form.html posts partner_count plus partner_<i>_<field> for i in range(partner_count);
+# the (field, form key) pairs are built once instead of formatted per request
+GENERATE_MAX_PARTNERS = 50
+PARTNER_FORM_KEYS = tuple(tuple((field, f'partner_{i}_{field}') for field in PARTNER_FIELDS)
+                          for i in range(GENERATE_MAX_PARTNERS))
+COMPANY_FORM_FIELDS = ('company_name', 'company_address', 'company_object', 'company_cnae_list',
+                       'start_date', 'capital_currency', 'signature_date')
+
+DOCX_MIMETYPE = 'application/vnd.openxmlformats-officedocument.wordprocessingml.document'
+
+# Contracts rendered by /generate wait in UPLOAD_FOLDER until /download picks
+# them up, so any worker on the instance can serve them. They carry personal
+# data: deleting the contract removes the file, and files older than
+# RENDERED_CONTRACT_MAX_AGE are swept whenever a new one is written.
+RENDERED_CONTRACT_RE = re.compile(r'contract_([0-9a-fA-F-]+)\.docx')
+RENDERED_CONTRACT_MAX_AGE = 24 * 60 * 60  # 1 day
+
+def save_rendered_contract(filename, data):
+    path = os.path.join(app.config['UPLOAD_FOLDER'], filename)
+    # Write-then-rename so another worker never serves a partial file
+    tmp_path = f"{path}.{uuid.uuid4().hex}.tmp"
+    with open(tmp_path, 'wb') as f:
+        f.write(data)
+    os.replace(tmp_path, path)
+    evict_stale_rendered_contracts()
+
+def remove_rendered_contract(contract_id):
+    filename = f"contract_{contract_id}.docx"
+    if RENDERED_CONTRACT_RE.fullmatch(filename):
+        remove_upload(os.path.join(app.config['UPLOAD_FOLDER'], filename))
+
+def evict_stale_rendered_contracts():
+    cutoff = time.time() - RENDERED_CONTRACT_MAX_AGE
+    try:
+        for entry in os.scandir(app.config['UPLOAD_FOLDER']):
+            if RENDERED_CONTRACT_RE.fullmatch(entry.name) and entry.stat().st_mtime < cutoff:
+                os.remove(entry.path)
+    except OSError as e:
+        logger.warning("Could not evict stale contracts: %s", e)
+
+# Renders keyed by template + context digest: downloading an unchanged
+# contract again serves the previous bytes instead of re-rendering. Memory
+# only, since contracts carry CPFs and addresses; drop any renders an older
+# version of the app left on disk.
+_contract_renders = BytesLRU(32)
+shutil.rmtree(os.path.join(app.config['UPLOAD_FOLDER'], 'render_cache'), ignore_errors=True)
+
+def send_contract(data, download_name):
+    """
+    Send a rendered contract with a content-hash ETag. A contract URL can be
+    re-rendered with new data at any time, so clients revalidate instead of
+    caching for a fixed period; unchanged documents come back as a 304.
+    """
+    response = send_file(io.BytesIO(data), as_attachment=True, mimetype=DOCX_MIMETYPE,
+                         download_name=download_name, conditional=True,
+                         etag=hashlib.sha256(data).hexdigest()[:32])
+    # Contracts carry personal data: never store them in shared caches
+    response.cache_control.private = True
+    response.cache_control.no_cache = True
+    return response
+
+CONTRACT_TEMPLATE_PATH = os.path.join(BASE_DIR, 'contract_template.docx')
+
+# Template .docx bytes per path, reloaded when the file's mtime changes
+_template_bytes = {}
+
+def read_template_bytes(template_path, mtime):
+    cached = _template_bytes.get(template_path)
+    if cached is None or cached[0] != mtime:
+        with open(template_path, 'rb') as f:
+            cached = (mtime, f.read())
+        _template_bytes[template_path] = cached
+    return cached[1]
+
+def render_contract(context, template_path=CONTRACT_TEMPLATE_PATH):
+    """
+    Render the contract template with `context` and return the .docx bytes.
+    Raises FileNotFoundError when the template is missing.
+    """
+    # Raises FileNotFoundError for a missing template before any render work
+    template_mtime = os.path.getmtime(template_path)
+    try:
+        hasher = hashlib.sha256(f"{template_path}\0{template_mtime}\0".encode())
+        hasher.update(orjson.dumps(context, option=orjson.OPT_SORT_KEYS))
+        key = hasher.hexdigest()
+    except TypeError:
+        key = None
+    
+    data = _contract_renders.get(key) if key else None
+    if data is not None:
+        logger.debug("Contract render cache hit: %s", key[:12])
+        return data
+    
+    doc = get_contract_template_class()(io.BytesIO(read_template_bytes(template_path, template_mtime)))
+    doc.render(context, jinja_env=JINJA_ENV)
+    buf = io.BytesIO()
+    doc.save(buf)
+    data = buf.getvalue()
+    if key:
+        _contract_renders.put(key, data)
+    return data
+
+def persist_contract(contract_id, contract_payload):
+    """
+    Insert or update the contract row in a single upsert round-trip.
+    Returns False when the write failed.
+    """
+    try:
+        execute_with_reconnect(supabase_client.table('contracts')
+                               .upsert({'id': contract_id, **contract_payload},
+                                       on_conflict='id', returning=ReturnMethod.minimal))
+        logger.debug("Saved contract %s in Supabase", contract_id)
+        return True
+    except Exception as e:
+        logger.error("Failed to save contract %s to Supabase: %s", contract_id, e)
+        return False
+
+@app.before_request
+def guard_generate_form():
+    if request.endpoint != 'generate':
+        return None
+    if request.mimetype not in GENERATE_CONTENT_TYPES:
+        abort(415)
+    if request.content_length is not None and request.content_length > GENERATE_MAX_CONTENT_LENGTH:
+        abort(413)
+    # Also caps chunked bodies that don't announce a Content-Length
+    request.max_content_length = GENERATE_MAX_CONTENT_LENGTH
+    return None
+
 @app.route('/generate', methods=['POST'])
 def generate():
     try:
-        print("[DEBUG] Starting generate route")
+        logger.debug("Starting generate route")
         
-        # Reconstruct data from form
-        partners = []
+        # Reconstruct data from form (parsed once into a plain dict)
+        form = request.form.to_dict()
         
-        # Simple parser for "partner_i_field"
-        p_indices = set()
-        for key in request.form.keys():
-            if key.startswith('partner_') and '_' in key:
-                parts = key.split('_')
-                if len(parts) >= 2 and parts[1].isdigit():
-                    p_indices.add(int(parts[1]))
+        try:
+            partner_count = max(0, min(GENERATE_MAX_PARTNERS, int(form['partner_count'])))
+        except (KeyError, ValueError):
+            partner_count = None
         
-        print(f"[DEBUG] Found partner indices: {p_indices}")
+        if partner_count is not None:
+            # Direct lookups for the partners the form says it has
+            partners = [{field: form.get(key, '') for field, key in PARTNER_FORM_KEYS[i]}
+                        for i in range(partner_count)]
+        else:
+            # Forms rendered before partner_count existed: group "partner_<i>_<field>"
+            # values by partner in one pass over the form
+            partners_by_idx = {}
+            for key, value in form.items():
+                m = PARTNER_KEY_RE.fullmatch(key)
+                if m:
+                    partners_by_idx.setdefault(int(m.group(1)), {})[m.group(2)] = value
+            partners = [{field: fields.get(field, '') for field in PARTNER_FIELDS}
+                        for _, fields in sorted(partners_by_idx.items())]
         
-        for i in sorted(list(p_indices)):
-            p_data = {
-                'name': request.form.get(f'partner_{i}_name', ''),
-                'nationality': request.form.get(f'partner_{i}_nationality', ''),
-                'civil_state': request.form.get(f'partner_{i}_civil_state', ''),
-                'regime': request.form.get(f'partner_{i}_regime', ''),
-                'profession': request.form.get(f'partner_{i}_profession', ''),
-                'birth_date': request.form.get(f'partner_{i}_birth_date', ''),
-                'cpf': request.form.get(f'partner_{i}_cpf', ''),
-                'address': request.form.get(f'partner_{i}_address', ''),
-                'quotas': request.form.get(f'partner_{i}_quotas', ''),
-                'amount': request.form.get(f'partner_{i}_amount', ''),
-                'percent': request.form.get(f'partner_{i}_percent', '')
-            }
-            partners.append(p_data)
-            print(f"[DEBUG] Partner {i} data: {p_data}")
+        logger.debug("Found %s partners", len(partners))
+        # Drop slots left completely blank, keeping one so the template's partner
+        # block still renders (with placeholders) when nothing was filled in
+        partners = [p for p in partners if any(p.values())] or partners[:1]
             
-        company_data = {
-            'company_name': request.form.get('company_name', ''),
-            'company_address': request.form.get('company_address', ''),
-            'company_object': request.form.get('company_object', ''),
-            'company_cnae_list': request.form.get('company_cnae_list', ''),
-            'start_date': request.form.get('start_date', ''),
-            'capital_currency': request.form.get('capital_currency', ''),
-            'signature_date': request.form.get('signature_date', ''),
-            'partners': partners,
-            'administrator_names': ", ".join([p['name'] for p in partners if p['name']])
-        }
-        
-        print(f"[DEBUG] Company data: {company_data}")
+        company_data = {field: form.get(field, '') for field in COMPANY_FORM_FIELDS}
+        company_data['partners'] = partners
+        company_data['administrator_names'] = ", ".join(filter(None, map(itemgetter('name'), partners)))
         
-        # Save to Supabase
-        contract_id = request.form.get('contract_id')
+        # Save to Supabase off the request path. New contracts get their id
+        # here so the document filename doesn't wait for the insert.
+        contract_id = form.get('contract_id')
+        persist_future = None
         if supabase_client:
-            try:
-                contract_payload = {
-                    'name': company_data.get('company_name') or 'Contrato Sem Nome',
-                    'status': 'completed',
-                    'partners': partners,
-                    'company_data': company_data,
-                    'updated_at': 'now()'
-                }
-                
-                if contract_id:
-                    # Update existing
-                    supabase_client.table('contracts').update(contract_payload).eq('id', contract_id).execute()
-                    print(f"[DEBUG] Updated contract {contract_id} in Supabase")
-                else:
-                    # Create new
-                    result = supabase_client.table('contracts').insert(contract_payload).execute()
-                    if result.data:
-                        contract_id = result.data[0]['id']
-                        print(f"[DEBUG] Created new contract {contract_id} in Supabase")
-            except Exception as e:
-                print(f"[ERROR] Failed to save to Supabase: {e}")
+            if not contract_id:
+                contract_id = str(uuid.uuid4())
+            contract_payload = {
+                'name': company_data.get('company_name') or 'Contrato Sem Nome',
+                'status': 'completed',
+                'partners': partners,
+                'company_data': company_data,
+                # The table has no update trigger, so stamp it explicitly
+                'updated_at': datetime.now(timezone.utc).isoformat()
+            }
+            persist_future = run_in_background(persist_contract, contract_id, contract_payload)
 
-        # Generate Document
-        template_path = os.path.join(BASE_DIR, 'contract_template.docx')
-        if not os.path.exists(template_path):
+        # Generate Document (without Supabase the name only has to be unique)
+        output_filename = f"contract_{contract_id or uuid.uuid4().hex}.docx"
+        try:
+            # Apply placeholders to ensure consistent download experience
+            save_rendered_contract(output_filename, render_contract(apply_placeholders(company_data)))
+        except FileNotFoundError:
             flash('Erro: Template de contrato não encontrado.', 'error')
             return redirect(url_for('index'))
-            
-        output_filename = f"contract_{contract_id or 'temp'}.docx"
-        output_path = os.path.join(app.config['UPLOAD_FOLDER'], output_filename)
-        
-        print(f"[DEBUG] Template path: {template_path}")
-        print(f"[DEBUG] Output path: {output_path}")
-        
-        doc = DocxTemplate(template_path)
-        # Apply placeholders to ensure consistent download experience
-        doc.render(apply_placeholders(company_data))
-        doc.save(output_path)
+        finally:
+            # The write ran alongside the render; on serverless make sure it landed
+            finish_background_write(persist_future)
         
-        print("[DEBUG] Document generated successfully")
+        logger.debug("Document generated successfully")
         display_name = f"Contrato Social - {company_data.get('company_name', 'Novo')}.docx"
         return render_template('download.html', filename=output_filename, display_name=display_name)
     except Exception as e:
-        print(f"[ERROR] Generate failed: {e}")
-        traceback.print_exc()
+        logger.exception("Generate failed: %s", e)
         return f"<h1>Erro ao gerar contrato</h1><pre>{e}</pre>", 500
 
 @app.route('/download/<filename>')
 def download_file(filename):
     # Sanitize filename to prevent directory traversal
     safe_filename = os.path.basename(filename)
-    path = os.path.join(app.config['UPLOAD_FOLDER'], safe_filename)
+    custom_name = request.args.get('name')
+    download_name = custom_name if custom_name else safe_filename
+    
+    # Only rendered contracts are served; UPLOAD_FOLDER holds other files too
+    m = RENDERED_CONTRACT_RE.fullmatch(safe_filename)
+    if not m:
+        return "Arquivo não encontrado", 404
     
-    if not os.path.exists(path):
+    try:
+        # safe_join + existence check + conditional send in one call
+        response = send_from_directory(app.config['UPLOAD_FOLDER'], safe_filename, as_attachment=True,
+                                       download_name=download_name, conditional=True)
+    except NotFound:
+        # Rendered on another instance (or evicted): rebuild it from the saved contract
+        if supabase_client:
+            return redirect(url_for('download_contract', id=m.group(1), name=custom_name))
         return "Arquivo não encontrado", 404
         
-    custom_name = request.args.get('name')
-    return send_file(path, as_attachment=True, download_name=custom_name if custom_name else safe_filename)
+    response.cache_control.private = True
+    response.cache_control.no_cache = True
+    return response
 
 # API Routes for Dashboard
 @app.route('/api/contracts/<id>', methods=['DELETE'])
@@ -928,10 +1600,35 @@ def delete_contract(id):
         return jsonify({'error': 'Database not configured'}), 503
     
     try:
-        supabase_client.table('contracts').delete().eq('id', id).execute()
+        execute_with_reconnect(supabase_client.table('contracts')
+                               .delete(returning=ReturnMethod.minimal).eq('id', id))
+        remove_rendered_contract(id)
         return jsonify({'success': True})
     except Exception as e:
-        print(f"[ERROR] Delete failed: {e}")
+        logger.error("Delete failed: %s", e)
+        return jsonify({'error': str(e)}), 500
+
+@app.route('/api/contracts', methods=['DELETE'])
+def delete_contracts():
+    """Delete several contracts in one round-trip. Body: {"ids": [...]}"""
+    if not supabase_client:
+        return jsonify({'error': 'Database not configured'}), 503
+    
+    data = request.get_json(silent=True) or {}
+    ids = data.get('ids')
+    if not isinstance(ids, list) or not ids or not all(isinstance(i, (str, int)) for i in ids):
+        return jsonify({'error': 'Expected a non-empty "ids" list'}), 400
+    
+    try:
+        # Ask for an exact count so unknown ids are not reported as deleted
+        response = execute_with_reconnect(supabase_client.table('contracts')
+                                          .delete(count=CountMethod.exact, returning=ReturnMethod.minimal)
+                                          .in_('id', ids))
+        for contract_id in ids:
+            remove_rendered_contract(contract_id)
+        return jsonify({'success': True, 'deleted': response.count or 0})
+    except Exception as e:
+        logger.error("Batch delete failed: %s", e)
         return jsonify({'error': str(e)}), 500
 
 @app.route('/contract/<id>/edit')
@@ -940,11 +1637,12 @@ def edit_contract(id):
         return redirect(url_for('index'))
         
     try:
-        result = supabase_client.table('contracts').select('*').eq('id', id).execute()
-        if not result.data:
+        result = execute_with_reconnect(supabase_client.table('contracts')
+                                        .select(EDIT_COLUMNS).eq('id', id).maybe_single())
+        if not result or not result.data:
             return "Contrato não encontrado", 404
             
-        contract = result.data[0]
+        contract = result.data
         partners = contract.get('partners', [])
         company = contract.get('company_data', {})
         
@@ -954,121 +1652,232 @@ def edit_contract(id):
                              contract_id=id,
                              partner_count=len(partners))
     except Exception as e:
-        print(f"[ERROR] Edit load failed: {e}")
+        logger.error("Edit load failed: %s", e)
         return f"Erro ao carregar contrato: {e}", 500
 
+# docxtpl (and lxml underneath) is only imported by the first contract render
+@lazy
+def get_contract_template_class():
+    from docxtpl import DocxTemplate
+
+    class ContractTemplate(DocxTemplate):
+        """
+        DocxTemplate that reuses the regex-patched XML of template parts it has
+        already seen. patch_xml only depends on the template itself, so every
+        render after the first skips that work; a changed template file produces
+        different XML and simply gets a new entry.
+        """
+        _patched_xml = {}
+        _max_entries = 32
+
+        def patch_xml(self, src_xml):
+            patched = self._patched_xml.get(src_xml)
+            if patched is None:
+                patched = super().patch_xml(src_xml)
+                if len(self._patched_xml) < self._max_entries:
+                    self._patched_xml[src_xml] = patched
+            return patched
+
+    return ContractTemplate
+
+class ContractJinjaEnvironment(jinja2.Environment):
+    """
+    Jinja environment shared by every contract render. docxtpl compiles each
+    template part with from_string(); the patched XML is identical between
+    renders, so the compiled template is memoized instead of re-parsed.
+    """
+    _max_compiled = 32
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self._compiled = {}
+
+    def from_string(self, source, globals=None, template_class=None):
+        if globals or template_class:
+            return super().from_string(source, globals, template_class)
+        template = self._compiled.get(source)
+        if template is None:
+            template = super().from_string(source)
+            if len(self._compiled) < self._max_compiled:
+                self._compiled[source] = template
+        return template
+
+JINJA_ENV = ContractJinjaEnvironment(auto_reload=False)
+
+# Placeholders for fields whose generic "[FIELD NAME]" form reads badly
+PLACEHOLDER_MAP = {
+    'name': '[NOME COMPLETO]',
+    'cpf': '[CPF]',
+    'rg': '[RG]',
+    'nationality': '[NACIONALIDADE]',
+    'civil_state': '[ESTADO CIVIL]',
+    'profession': '[PROFISSÃO]',
+    'address': '[ENDEREÇO COMPLETO]',
+    'company_name': '[RAZÃO SOCIAL]',
+    'company_address': '[ENDEREÇO DA SEDE]',
+    'capital_currency': '[CAPITAL R$]',
+    'capital_amount_text': '[CAPITAL POR EXTENSO]',
+    'start_date': '[DATA DE INÍCIO]',
+    'signature_date': '[DATA DE ASSINATURA]'
+}
+
+def placeholder_for(key):
+    placeholder = PLACEHOLDER_MAP.get(key)
+    if placeholder:
+        return placeholder
+    # Check for partner specific keys
+    if 'partner' in key and 'name' in key:
+        return '[NOME DO SÓCIO]'
+    return f"[{key.upper().replace('_', ' ')}]"
+
+def has_empty_field(data):
+    """True if apply_placeholders would replace anything in `data` (stops at the first hit)."""
+    if type(data) is dict:
+        for v in data.values():
+            if type(v) is dict or type(v) is list:
+                if has_empty_field(v):
+                    return True
+            elif not v or str(v).strip() == "":
+                return True
+    elif type(data) is list:
+        # Only nested dicts get placeholders; bare list items are kept as-is
+        return any(has_empty_field(item) for item in data if type(item) is dict or type(item) is list)
+    return False
+
 def apply_placeholders(data):
     """
     Recursively replaces empty values in the data dictionary with placeholders.
+    Data without empty fields is returned as-is, without copying.
     """
-    if isinstance(data, dict):
+    if not has_empty_field(data):
+        return data
+    return _apply_placeholders(data)
+
+def _apply_placeholders(data):
+    if type(data) is dict:
         new_data = {}
         for k, v in data.items():
-            if isinstance(v, (dict, list)):
-                new_data[k] = apply_placeholders(v)
+            if type(v) is dict or type(v) is list:
+                new_data[k] = _apply_placeholders(v)
             elif not v or str(v).strip() == "":
-                # Generate placeholder based on key
-                placeholder = f"[{k.upper().replace('_', ' ')}]"
-                
-                # Custom mappings for better readability
-                mappings = {
-                    'name': '[NOME COMPLETO]',
-                    'cpf': '[CPF]',
-                    'rg': '[RG]',
-                    'nationality': '[NACIONALIDADE]',
-                    'civil_state': '[ESTADO CIVIL]',
-                    'profession': '[PROFISSÃO]',
-                    'address': '[ENDEREÇO COMPLETO]',
-                    'company_name': '[RAZÃO SOCIAL]',
-                    'company_address': '[ENDEREÇO DA SEDE]',
-                    'capital_currency': '[CAPITAL R$]',
-                    'capital_amount_text': '[CAPITAL POR EXTENSO]',
-                    'start_date': '[DATA DE INÍCIO]',
-                    'signature_date': '[DATA DE ASSINATURA]'
-                }
-                
-                # Check for partner specific keys
-                if k in mappings:
-                    placeholder = mappings[k]
-                elif 'partner' in k and 'name' in k:
-                    placeholder = '[NOME DO SÓCIO]'
-                
-                new_data[k] = placeholder
+                new_data[k] = placeholder_for(k)
             else:
                 new_data[k] = v
         return new_data
-    elif isinstance(data, list):
-        return [apply_placeholders(item) for item in data]
+    elif type(data) is list:
+        return [_apply_placeholders(item) for item in data]
     return data
 
+# Standard keys expected by the template, for forced downloads of empty drafts
+EMPTY_COMPANY_DEFAULTS = dict.fromkeys((
+    'company_name', 'company_address', 'company_object', 'company_cnae_list',
+    'start_date', 'capital_currency', 'capital_amount_text', 'total_quotas',
+    'quota_value', 'forum_city', 'signature_date', 'administrator_names'
+), '')
+EMPTY_PARTNER = dict.fromkeys(PARTNER_FIELDS, '')
+
 @app.route('/contract/<id>/download')
 def download_contract(id):
     if not supabase_client:
         return redirect(url_for('index'))
         
     try:
-        result = supabase_client.table('contracts').select('*').eq('id', id).execute()
-        if not result.data:
+        result = execute_with_reconnect(supabase_client.table('contracts')
+                                        .select(DOWNLOAD_COLUMNS).eq('id', id).maybe_single())
+        if not result or not result.data:
             return "Contrato não encontrado", 404
             
-        contract = result.data[0]
+        contract = result.data
         company_data = contract.get('company_data', {}) or {}
-        status = contract.get('status', 'draft')
         
         # Check if force download is requested
         force_download = request.args.get('force') == 'true'
         
         # If force download and data is empty/incomplete, populate with defaults to ensure keys exist
         if force_download:
-             # Standard keys expected by the template
-            default_keys = [
-                'company_name', 'company_address', 'company_object', 'company_cnae_list',
-                'start_date', 'capital_currency', 'capital_amount_text', 'total_quotas',
-                'quota_value', 'forum_city', 'signature_date', 'administrator_names'
-            ]
-            for key in default_keys:
-                if key not in company_data or not company_data[key]:
-                    company_data[key] = ""
+            # Missing keys become "" (empty ones get placeholders below either way)
+            company_data = {**EMPTY_COMPANY_DEFAULTS, **company_data}
             
             # Ensure at least one dummy partner if none exist, so the loop in docx works
-            if 'partners' not in company_data or not company_data['partners']:
-                company_data['partners'] = [{
-                    'name': '', 'nationality': '', 'civil_state': '', 'regime': '',
-                    'profession': '', 'birth_date': '', 'cpf': '', 'address': '',
-                    'quotas': '', 'amount': '', 'percent': ''
-                }]
+            if not company_data.get('partners'):
+                company_data['partners'] = [dict(EMPTY_PARTNER)]
 
         if not company_data and not force_download:
             return "Dados do contrato incompletos (use 'Baixar Assim Mesmo' para forçar)", 400
             
-        # Re-generate document
-        template_path = os.path.join(BASE_DIR, 'contract_template.docx')
-        if not os.path.exists(template_path):
+        # Placeholders for empty fields, exactly as /generate renders it
+        data_to_render = apply_placeholders(company_data)
+        
+        # Re-generate document (served from the render cache if unchanged)
+        try:
+            data = render_contract(data_to_render)
+        except FileNotFoundError:
             return "Template de contrato não encontrado", 500
-            
-        output_filename = f"contract_{id}.docx"
-        output_path = os.path.join(app.config['UPLOAD_FOLDER'], output_filename)
         
-        # Apply placeholders if it's a draft or force download
-        data_to_render = company_data
-        if status != 'completed' or force_download:
-             data_to_render = apply_placeholders(company_data)
+        download_name = (request.args.get('name')
+                         or f"Contrato Social - {company_data.get('company_name', 'Novo')}.docx")
+        return send_contract(data, download_name)
+    except Exception as e:
+        logger.exception("Download generate failed: %s", e)
+        return f"Erro ao gerar download: {e}", 500
+
+def extract_uploaded_document(filepath, doc_type):
+    """
+    Extract the fields of one saved upload for the given document type
+    (identity, address or company) and remove the file afterwards.
+    Extraction failures are logged and yield an empty dict.
+    """
+    extracted_data = {}
+    
+    try:
+        # 1. Extract data based on type
+        if doc_type == 'address':
+            # For address documents
+            addr_data = extract_address_data(filepath)
+                
+            if addr_data:
+                # Format address
+                if addr_data.get('full_address'):
+                    extracted_data['address'] = addr_data['full_address']
+                elif addr_data.get('street'):
+                    extract_c = addr_data
+                    parts = [
+                        extract_c.get('street', ''),
+                        extract_c.get('number', ''),
+                        extract_c.get('complement', ''),
+                        extract_c.get('neighborhood', ''),
+                        f"{extract_c.get('city', '')}/{extract_c.get('state', '')}" if extract_c.get('city') else '',
+                        f"CEP {extract_c.get('zip_code', '')}" if extract_c.get('zip_code') else ''
+                    ]
+                    extracted_data['address'] = ', '.join(p for p in parts if p and p != '/' and p != 'CEP ')
         
-        doc = DocxTemplate(template_path)
-        doc.render(data_to_render)
-        doc.save(output_path)
+        elif doc_type == 'company':
+            extracted_data = extract_document_data(filepath, COMPANY_SERVICE_OPTIONS)
         
-        return send_file(output_path, as_attachment=True, download_name=f"Contrato Social - {company_data.get('company_name', 'Novo')}.docx")
+        else:
+            # Identity documents (generic extraction)
+            extracted_data = extract_document_data(filepath)
+    
     except Exception as e:
-        print(f"[ERROR] Download generate failed: {e}")
-        traceback.print_exc()
-        return f"Erro ao gerar download: {e}", 500
+        logger.exception("Extraction failure: %s", e)
+    finally:
+        # Always clean up the uploaded file
+        remove_upload(filepath)
+    
+    return extracted_data
+
+def save_scratch_upload(file):
+    # Unique name: several uploads may be in flight at once
+    filepath = os.path.join(app.config['SCRATCH_FOLDER'], f"temp_{uuid.uuid4().hex}_{file.filename}")
+    save_upload(file, filepath)
+    return filepath
 
 @app.route('/api/extract-document', methods=['POST'])
 def extract_single_document():
     """
     API endpoint to extract data from a single document.
-    Designed to be called sequentially from frontend to avoid memory overload.
+    The frontend calls it for a few files at a time (MAX_PARALLEL_UPLOADS in
+    upload.html) to overlap AI latency without overloading memory.
     """
     try:
         if 'file' not in request.files:
@@ -1080,108 +1889,32 @@ def extract_single_document():
         if file.filename == '':
             return jsonify({'error': 'No selected file'}), 400
 
-        print(f"[DEBUG] Processing single file: {file.filename} (type: {doc_type})")
-        
-        # Save file temporarily
-        filepath = os.path.join(app.config['UPLOAD_FOLDER'], f"temp_{int(time.time())}_{file.filename}")
-        file.save(filepath)
-        
-        extracted_data = {}
+        logger.debug("Processing single file: %s (type: %s)", file.filename, doc_type)
         
-        try:
-            # 1. Extract data based on type
-            if doc_type == 'address':
-                # For address documents
-                # First try to convert PDF to image if needed
-                ext = filepath.lower().split('.')[-1]
-                img_path = None
-                if ext == 'pdf':
-                    img_path = convert_pdf_to_image(filepath)
-                    working_path = img_path if img_path else filepath
-                else:
-                    working_path = filepath
-                
-                addr_data = extract_address_from_proof(working_path)
-                
-                # Cleanup temp image from conversion
-                if img_path and os.path.exists(img_path):
-                    try:
-                        os.remove(img_path)
-                    except: pass
-                    
-                if addr_data:
-                    # Format address
-                    if addr_data.get('full_address'):
-                        extracted_data['address'] = addr_data['full_address']
-                    elif addr_data.get('street'):
-                        extract_c = addr_data
-                        parts = [
-                            extract_c.get('street', ''),
-                            extract_c.get('number', ''),
-                            extract_c.get('complement', ''),
-                            extract_c.get('neighborhood', ''),
-                            f"{extract_c.get('city', '')}/{extract_c.get('state', '')}" if extract_c.get('city') else '',
-                            f"CEP {extract_c.get('zip_code', '')}" if extract_c.get('zip_code') else ''
-                        ]
-                        extracted_data['address'] = ', '.join(p for p in parts if p and p != '/' and p != 'CEP ')
-            
-            else:
-                # Identity or Company documents (generic extraction)
-                extracted_data = extract_document_data(filepath)
-        
-        except Exception as e:
-            print(f"[ERROR] Extraction failure: {e}")
-            traceback.print_exc()
-        finally:
-            # Always clean up the uploaded file
-            if os.path.exists(filepath):
-                try:
-                    os.remove(filepath)
-                except:
-                    pass
-            
-            # Explicit GC
-            gc.collect()
-        
-        return jsonify(extracted_data)
+        filepath = save_scratch_upload(file)
+        return jsonify(extract_uploaded_document(filepath, doc_type))
 
     except Exception as e:
-        print(f"[ERROR] API Error: {e}")
+        logger.error("API Error: %s", e)
         return jsonify({'error': str(e)}), 500
 
 @app.route('/process-json', methods=['POST'])
 def process_json():
     """Receiver for the consolidated JSON data from client-side sequential processing."""
     try:
-        print("[INFO] Received consolidated JSON data")
+        logger.info("Received consolidated JSON data")
         data = request.json
         if not data:
-             print("[ERROR] No JSON data received in /process-json")
+             logger.error("No JSON data received in /process-json")
              return jsonify({'error': 'No data received'}), 400
              
-        print(f"[DEBUG] JSON payload received, partners: {len(data.get('partners', []))}")
+        logger.debug("JSON payload received, partners: %s", len(data.get('partners', [])))
         
         partners_data = data.get('partners', [])
         company_data = data.get('company', {})
         
         # Save to Supabase (Draft)
-        contract_id = None
-        if supabase_client:
-            try:
-                draft_payload = {
-                    'name': company_data.get('company_name') or f'Rascunho {len(partners_data)} Sócios',
-                    'status': 'draft',
-                    'partners': partners_data,
-                    'company_data': company_data,
-                    'updated_at': 'now()'
-                }
-                res = supabase_client.table('contracts').insert(draft_payload).execute()
-                if res.data:
-                    contract_id = res.data[0]['id']
-                    print(f"[INFO] Created DRAFT contract {contract_id}")
-            except Exception as e:
-                print(f"[ERROR] Failed to save draft: {e}")
-                traceback.print_exc()
+        contract_id = save_draft(partners_data, company_data)
         
         has_data = any(p.get('name') for p in partners_data) or company_data.get('company_name')
         if not has_data:
@@ -1196,16 +1929,15 @@ def process_json():
                              partner_count=len(partners_data))
                              
     except Exception as e:
-        print(f"[ERROR] Process JSON failed: {e}")
-        traceback.print_exc()
+        logger.exception("Process JSON failed: %s", e)
         return jsonify({'error': str(e)}), 500
 
 @app.route('/api/health')
 def health_check():
     """Diagnostic endpoint to check system status."""
     status = {
-        'openai': openai_client is not None,
-        'mistral': mistral_client is not None,
+        'openai': bool(openai_key),
+        'mistral': bool(mistral_key),
         'supabase': supabase_client is not None,
         'upload_folder_exists': os.path.exists(app.config['UPLOAD_FOLDER']),
         'upload_folder_writable': os.access(app.config['UPLOAD_FOLDER'], os.W_OK),
@@ -1214,4 +1946,5 @@ def health_check():
     return jsonify(status)
 
 if __name__ == '__main__':
-    app.run(debug=True, port=5000)
+    # Development server only; production runs under gunicorn (gunicorn.conf.py)
+    app.run(debug=os.getenv('FLASK_DEBUG', '1') != '0', port=5000, threaded=True)
@@ -0,0 +1,130 @@
+"""
+Bulk extraction of text-based PDFs through the OpenAI Batch API.
+
+For backlogs that are not latency critical: every PDF in a folder is sent in
+a single batch job (about half the price of the synchronous calls made by the
+web app), polled until it finishes, and the parsed results are written as one
+JSON file keyed by filename.
+
+Usage: python execution/batch_extract.py <pdf_folder> [output.json]
+"""
+import os
+import sys
+import time
+import hashlib
+
+import orjson
+import pypdf
+from dotenv import load_dotenv
+from openai import OpenAI
+
+# Add parent directory to path for imports
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+# Shared with the web app, without importing (and starting) app.py itself
+from prompts import CONTRACT_PROMPT, CONTRACT_RESPONSE_FORMAT, PDF_TEXT_LIMIT
+from pdf_text import strip_page_furniture, join_page_texts
+from utils import get_logger
+
+logger = get_logger("batch_extract")
+
+POLL_INTERVAL = 30  # seconds
+FINAL_STATUSES = ('completed', 'failed', 'expired', 'cancelled')
+
+
+def extract_text_from_pdf(filepath):
+    """PDF text layer cleaned the same way the app does, capped at PDF_TEXT_LIMIT."""
+    try:
+        reader = pypdf.PdfReader(filepath)
+        return join_page_texts(strip_page_furniture(page.extract_text(extraction_mode="plain")
+                                                    for page in reader.pages), PDF_TEXT_LIMIT)
+    except Exception as e:
+        logger.error("Error reading PDF %s: %s", filepath, e)
+        return ""
+
+
+def build_requests(folder):
+    """One /v1/chat/completions request per PDF, same prompt and schema as the app."""
+    requests, names = [], {}
+    for name in sorted(os.listdir(folder)):
+        if not name.lower().endswith('.pdf'):
+            continue
+        text = extract_text_from_pdf(os.path.join(folder, name))
+        if not text.strip():
+            logger.warning("No text layer, skipping (scans need the Vision path): %s", name)
+            continue
+        custom_id = hashlib.sha256(name.encode('utf-8')).hexdigest()[:32]
+        names[custom_id] = name
+        requests.append({
+            "custom_id": custom_id,
+            "method": "POST",
+            "url": "/v1/chat/completions",
+            "body": {
+                "model": "gpt-4o",
+                "messages": [
+                    {"role": "system", "content": f"You are a legal assistant.\n{CONTRACT_PROMPT}"},
+                    {"role": "user", "content": f"Text:\n{text[:PDF_TEXT_LIMIT]}"}
+                ],
+                "response_format": CONTRACT_RESPONSE_FORMAT
+            }
+        })
+    return requests, names
+
+
+def run_batch(client, requests):
+    """Upload the JSONL, start the batch and wait for it to finish."""
+    jsonl = b"\n".join(orjson.dumps(r) for r in requests)
+    batch_file = client.files.create(file=("batch_input.jsonl", jsonl), purpose="batch")
+    batch = client.batches.create(input_file_id=batch_file.id, endpoint="/v1/chat/completions",
+                                  completion_window="24h")
+    logger.info("Batch %s submitted with %s documents", batch.id, len(requests))
+
+    while batch.status not in FINAL_STATUSES:
+        time.sleep(POLL_INTERVAL)
+        batch = client.batches.retrieve(batch.id)
+        logger.info("Batch %s: %s (%s)", batch.id, batch.status, batch.request_counts)
+    return batch
+
+
+def parse_results(client, batch, names):
+    """Map each output line back to its filename; failed documents get {}."""
+    results = {name: {} for name in names.values()}
+    if not batch.output_file_id:
+        return results
+    for line in client.files.content(batch.output_file_id).content.splitlines():
+        item = orjson.loads(line)
+        name = names.get(item.get("custom_id"))
+        try:
+            content = item["response"]["body"]["choices"][0]["message"]["content"]
+            # Same cleanup as extract_data_with_ai: drop fields that were not found
+            results[name] = {k: v for k, v in orjson.loads(content).items() if v}
+        except (KeyError, IndexError, TypeError, ValueError) as e:
+            logger.error("Could not parse result for %s: %s", name, e)
+    return results
+
+
+if __name__ == "__main__":
+    if len(sys.argv) < 2:
+        print(__doc__)
+        sys.exit(1)
+    folder = sys.argv[1]
+    output_path = sys.argv[2] if len(sys.argv) > 2 else ".tmp/batch_results.json"
+
+    load_dotenv()
+    if not os.getenv("OPENAI_API_KEY"):
+        logger.error("OPENAI_API_KEY not set")
+        sys.exit(1)
+    client = OpenAI()
+
+    requests, names = build_requests(folder)
+    if not requests:
+        logger.error("No text-based PDFs found in %s", folder)
+        sys.exit(1)
+
+    batch = run_batch(client, requests)
+    results = parse_results(client, batch, names)
+
+    os.makedirs(os.path.dirname(output_path) or ".", exist_ok=True)
+    with open(output_path, "wb") as f:
+        f.write(orjson.dumps(results, option=orjson.OPT_INDENT_2))
+    logger.info("Batch %s: results for %s documents written to %s", batch.status, len(results), output_path)
@@ -18,12 +18,13 @@ def create_contract_template():
     p = doc.add_paragraph()
     p.add_run("Pelo presente instrumento particular de Contrato Social:\n")
     
-    # Partner loop using simple jinja (no 'tr' tag)
+    # Partner loop using simple jinja (no 'tr' tag). The loop tags sit in plain
+    # runs outside the bold name run, so every repetition of the loop body
+    # starts with a complete bold run and each partner's name stays bold
     p.add_run("{% for p in partners %}")
     p.add_run("{{ p.name }}").bold = True
-    p.add_run(", {{ p.nationality }}, {{ p.civil_state }}, {{ p.regime }}, {{ p.profession }}, nascido(a) em {{ p.birth_date }}, nº do CPF {{ p.cpf }}, residente e domiciliada na {{ p.address }}")
-    p.add_run("{% if not loop.last %};\n{% else %};{% endif %}")
-    p.add_run("{% endfor %}")
+    p.add_run(", {{ p.nationality }}, {{ p.civil_state }}, {{ p.regime }}, {{ p.profession }}, nascido(a) em {{ p.birth_date }}, nº do CPF {{ p.cpf }}, residente e domiciliada na {{ p.address }}"
+              "{% if not loop.last %};\n{% else %};{% endif %}{% endfor %}")
 
     p = doc.add_paragraph()
     p.add_run("Resolvem, em comum acordo, constituir uma sociedade empresária limitada, nos termos da Lei n° 10.406/2002, mediante as condições e cláusulas seguintes:")
@@ -37,19 +38,14 @@ def create_contract_template():
 
     # Clause 2 - Head office
     doc.add_heading('CLÁUSULA II - DA SEDE', level=2)
-    p = doc.add_paragraph("A sociedade terá sua sede no seguinte endereço: ")
-    p.add_run("{{ company_address }}")
-    p.add_run(".")
+    p = doc.add_paragraph("A sociedade terá sua sede no seguinte endereço: {{ company_address }}.")
 
     # Clause 3 - Object
     doc.add_heading('CLÁUSULA III - DO OBJETO SOCIAL', level=2)
-    p = doc.add_paragraph("A sociedade terá por objeto o exercício das seguintes atividades econômica: ")
-    p.add_run("{{ company_object }}")
-    p.add_run(".")
+    p = doc.add_paragraph("A sociedade terá por objeto o exercício das seguintes atividades econômica: {{ company_object }}.")
     
     # Activities List
-    p = doc.add_paragraph("E exercerá as seguintes atividades:\n")
-    p.add_run("{{ company_cnae_list }}")
+    p = doc.add_paragraph("E exercerá as seguintes atividades:\n{{ company_cnae_list }}")
 
     # Clause 4 - Duration
     doc.add_heading('CLÁUSULA IV - DO INÍCIO DAS ATIVIDADES E PRAZO DE DURAÇÃO', level=2)
@@ -62,11 +58,8 @@ def create_contract_template():
     p = doc.add_paragraph("Parágrafo único. O capital encontra-se subscrito e integralizado pelos sócios da seguinte forma:")
     
     # Capital distribution as text list (docxtpl table row loops don't work when created via python-docx)
-    p = doc.add_paragraph()
-    p.add_run("{% for p in partners %}")
-    p.add_run("• {{ p.name }}: {{ p.quotas }} quotas, {{ p.amount }}, {{ p.percent }}%")
-    p.add_run("{% if not loop.last %}\n{% endif %}")
-    p.add_run("{% endfor %}")
+    p = doc.add_paragraph("{% for p in partners %}• {{ p.name }}: {{ p.quotas }} quotas, {{ p.amount }}, {{ p.percent }}%"
+                          "{% if not loop.last %}\n{% endif %}{% endfor %}")
     
     p = doc.add_paragraph()
     p.add_run("TOTAL: {{ total_quotas }} quotas, {{ capital_currency }}, 100%").bold = True
@@ -89,11 +82,8 @@ def create_contract_template():
     doc.add_paragraph()
     
     # Signature Loop
-    p = doc.add_paragraph()
-    p.add_run("{% for p in partners %}\n\n_______________________________________\n")
-    p.add_run("{{ p.name }}\n")
-    p.add_run("Sócio\n")
-    p.add_run("{% endfor %}")
+    p = doc.add_paragraph("{% for p in partners %}\n\n_______________________________________\n"
+                          "{{ p.name }}\nSócio\n{% endfor %}")
     p.alignment = WD_ALIGN_PARAGRAPH.CENTER
 
     doc.save('contract_template.docx')
@@ -0,0 +1,13 @@
+# Gunicorn settings, loaded automatically by `gunicorn app:app` from this folder.
+# Requests spend most of their time waiting on the OpenAI/Mistral APIs, so
+# threaded workers overlap those waits; a few processes cover CPU work (PDF
+# rendering, docx generation) and isolate crashes.
+import os
+
+worker_class = 'gthread'
+workers = int(os.getenv('WEB_CONCURRENCY', 2))
+threads = int(os.getenv('GUNICORN_THREADS', 8))
+# Extraction of a full /process upload can take a while on slow API days
+timeout = 120
+# Reuse keep-alive connections from the browser between the upload calls
+keepalive = 5
@@ -0,0 +1,53 @@
+"""
+Clean-up of PDF text layers before they are sent to the models.
+Shared by app.py and execution/batch_extract.py.
+"""
+import re
+from itertools import chain
+
+# "3", "Página 3", "pág. 3 de 12", "3/12"
+PAGE_NUMBER_RE = re.compile(r'(?:p[áa]g(?:ina)?\.?\s*)?(\d{1,4})(?:\s*(?:/|de)\s*\d{1,4})?', re.IGNORECASE)
+PAGE_EDGE_LINES = 2
+
+def strip_page_furniture(page_texts):
+    """
+    Drop running headers/footers and page numbers, which repeat on every page
+    and only cost tokens. Only the first/last PAGE_EDGE_LINES non-blank lines
+    of a page with body lines between them are candidates, so repeated values
+    in the body (or on a short signature page) are kept; a header is kept the
+    first time it appears, and a bare number only counts as a page number when
+    it matches the page's position in a document of several pages.
+    """
+    page_texts = iter(page_texts)
+    # Peek at the second page: in a one-page document a leading "1" is a clause number
+    first_pages = [page for page in (next(page_texts, None), next(page_texts, None)) if page is not None]
+    multi_page = len(first_pages) > 1
+    seen_edges = set()
+    for page_no, page_text in enumerate(chain(first_pages, page_texts), 1):
+        lines = page_text.splitlines()
+        nonblank = [i for i, line in enumerate(lines) if line.strip()]
+        if len(nonblank) <= 2 * PAGE_EDGE_LINES:
+            yield page_text
+            continue
+        edges = set(nonblank[:PAGE_EDGE_LINES] + nonblank[-PAGE_EDGE_LINES:])
+        kept = []
+        for i, line in enumerate(lines):
+            if i in edges:
+                key = line.strip()
+                m = PAGE_NUMBER_RE.fullmatch(key)
+                if (multi_page and m and int(m.group(1)) == page_no) or key in seen_edges:
+                    continue
+                seen_edges.add(key)
+            kept.append(line)
+        yield "\n".join(kept)
+
+def join_page_texts(page_texts, max_chars=None):
+    """Join per-page texts, stopping once `max_chars` have been collected."""
+    parts = []
+    collected = 0
+    for page_text in page_texts:
+        parts.append(page_text)
+        collected += len(page_text) + 1
+        if max_chars and collected >= max_chars:
+            break
+    return "\n".join(parts) + "\n" if parts else ""
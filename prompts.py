@@ -0,0 +1,144 @@
+"""
+Prompts and response schemas sent to the extraction models.
+
+Kept apart from app.py so offline tools (execution/batch_extract.py) can use
+the same instructions without starting the web app.
+"""
+
+# Extraction prompts. app.prompt_version() fingerprints each one for the
+# extraction cache, so editing a prompt automatically invalidates old results.
+CONTRACT_PROMPT = """
+    Extract data from the provided text for a "Contrato Social". 
+    Return a JSON object with keys: 
+    - name (Full Name)
+    - nationality
+    - civil_state
+    - regime (if married)
+    - profession
+    - birth_date
+    - cpf
+    - address (Full address including CEP)
+    
+    If it's a company document, extract:
+    - company_name
+    - company_address
+    - company_object
+    - company_cnae_list
+    - start_date
+    - capital_currency
+    - total_quotas
+    - quota_value
+    - forum_city
+    """
+
+# Brazilian identity documents, with emphasis on OCR correction
+IDENTITY_PROMPT = """Você é um especialista em OCR e extração de dados de documentos brasileiros.
+
+Analise esta imagem de documento de identificação (CNH, RG, CIN, Passaporte) e extraia os dados com MÁXIMA precisão.
+
+CAMPOS CRÍTICOS (Obrigatórios):
+- name: Nome completo (NOME). Se estiver em várias linhas, concatene. Corrija erros óbvios de OCR (ex: '0' em vez de 'O', '1' em vez de 'I').
+- cpf: O CPF é crucial. Procure formato XXX.XXX.XXX-XX. Se houver dígitos suspeitos, tente inferir pelo contexto.
+- birth_date: Data de nascimento (NASCIMENTO). Formato DD/MM/AAAA.
+
+CAMPOS ADICIONAIS:
+- nationality: Nacionalidade.
+- civil_state: Estado civil.
+- rg: Número do RG/Registro Geral.
+- rg_issuer: Órgão emissor (ex: SSP/SP, DETRAN/RJ).
+- cnh_number: Número de registro da CNH (se for CNH).
+- address: Endereço (se houver).
+- mother_name: Nome da mãe (FILIAÇÃO).
+- father_name: Nome do pai (FILIAÇÃO).
+
+DICAS DE EXTRAÇÃO:
+- CNH: O nome fica no topo. O CPF fica abaixo da foto ou no verso.
+- RG Antigo: Nome e filiação no verso.
+- CIN (RG Novo): QR Code no verso. Dados principais na frente.
+- Ignore marcas d'água, carimbos ou reflexos que atrapalhem a leitura.
+- Se um campo estiver ilegível, retorne null para ele.
+- Retorne APENAS JSON válido."""
+
+ADDRESS_PROMPT = """Você é um especialista em OCR de comprovantes de residência brasileiros.
+
+Analise esta imagem (conta de luz, água, telefone, internet ou fatura de cartão) e extraia o endereço com precisão.
+
+CAMPOS OBRIGATÓRIOS:
+- street: Logradouro (Rua, Av, Praça, etc) + Nome.
+- number: Número do imóvel. Se for 'S/N', retorne 'S/N'.
+- complement: Complemento (Ex: Apto 101, Bloco B).
+- neighborhood: Bairro.
+- city: Cidade.
+- state: Estado (UF, sigla de 2 letras).
+- zipcode: CEP (formato XXXXX-XXX).
+
+DICAS:
+- O endereço geralmente fica no topo, perto do nome do titular, ou no corpo da fatura.
+- Ignore endereços da empresa emissora da conta (ex: Enel, Sabesp, Claro). Procure o endereço do CLIENTE/DESTINATÁRIO.
+- Se houver códigos de barras ou números aleatórios, IGNORE.
+- Corrija erros comuns de OCR (ex: 'Rva' -> 'Rua').
+
+Retorne APENAS um objeto JSON válido."""
+
+MISTRAL_PROMPT = """Analise o texto a seguir e extraia as informações em formato JSON.
+
+Para documentos de identidade (RG, CNH, CIN):
+- name (Nome Completo)
+- nationality (Nacionalidade)  
+- civil_state (Estado Civil, se visível)
+- birth_date (Data de Nascimento no formato DD/MM/AAAA)
+- cpf (CPF, se visível)
+- address (Endereço completo formatado como: Rua Nome, Número, Bairro, Cidade/UF, CEP)
+
+Para documentos de empresa (Contrato Social, Cartão CNPJ):
+- company_name (Razão Social completa)
+- company_address (Endereço da Sede formatado como: Logradouro, Número, Complemento, Bairro, Cidade/UF, CEP 00000-000)
+- company_object (Objeto Social resumido)
+- company_cnae_list (Lista de CNAEs/Atividades separadas por vírgula)
+- start_date (Data de Início no formato DD/MM/AAAA)
+- capital_currency (Capital Social em R$)
+- total_quotas (Total de Quotas)
+- quota_value (Valor por Quota)
+- forum_city (Cidade do Foro)
+
+IMPORTANTE: Formate os endereços de forma limpa e legível, removendo quebras de linha e caracteres estranhos.
+
+Retorne APENAS o JSON. Texto do documento:
+"""
+
+# Identity document + address proof of the same partner, sent as two images
+PARTNER_PROMPT = f"""Você receberá DUAS imagens do mesmo sócio: a PRIMEIRA é um documento de identificação e a SEGUNDA é um comprovante de residência.
+
+Retorne um único objeto JSON com duas chaves:
+- "identity": dados da PRIMEIRA imagem, conforme as instruções A.
+- "address": dados da SEGUNDA imagem, conforme as instruções B.
+
+=== INSTRUÇÕES A (documento de identificação) ===
+{IDENTITY_PROMPT}
+
+=== INSTRUÇÕES B (comprovante de residência) ===
+{ADDRESS_PROMPT}"""
+
+# Largest text slice any AI parser uses (see extract_data_with_ai in app.py)
+PDF_TEXT_LIMIT = 15000
+
+# Structured output for CONTRACT_PROMPT: the model must return exactly these
+# keys (null when absent), so the reply always parses and needs no retry
+CONTRACT_FIELDS = (
+    'name', 'nationality', 'civil_state', 'regime', 'profession', 'birth_date', 'cpf', 'address',
+    'company_name', 'company_address', 'company_object', 'company_cnae_list', 'start_date',
+    'capital_currency', 'total_quotas', 'quota_value', 'forum_city'
+)
+CONTRACT_RESPONSE_FORMAT = {
+    "type": "json_schema",
+    "json_schema": {
+        "name": "contract_extraction",
+        "strict": True,
+        "schema": {
+            "type": "object",
+            "properties": {field: {"type": ["string", "null"]} for field in CONTRACT_FIELDS},
+            "required": list(CONTRACT_FIELDS),
+            "additionalProperties": False
+        }
+    }
+}